@@ -1,142 +1,341 @@
+import os
 import csv
-from collections import defaultdict
+import glob
 import numpy as np
 import argparse
+from itertools import repeat
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from track_store import store_path_for, write_track_store
 
-def process_csv(input_csv, output_csv, threshold=50.0):
-    # Read the input CSV file
+CLASS_LAYOUTS = ('interleaved', 'blocked')
+
+def build_class_layout(num_mice=5, layout='interleaved'):
+    """
+    Returns a list of (body_class, head_class) pairs, one per mouse.
+
+    'interleaved' pairs classes as (0, 1), (2, 3), ... (even body, odd head).
+    'blocked' lists all body classes first: (0, N), (1, N+1), ...
+    """
+    if layout == 'interleaved':
+        return [(mouse_index * 2, mouse_index * 2 + 1) for mouse_index in range(num_mice)]
+    if layout == 'blocked':
+        return [(mouse_index, mouse_index + num_mice) for mouse_index in range(num_mice)]
+    raise ValueError(f"Unknown class layout: {layout}")
+
+def read_detections(input_csv):
+    """Read Frame, Class, X and Y columns of a tracking CSV into numpy arrays."""
     with open(input_csv, 'r') as infile:
         reader = csv.DictReader(infile)
-        data = list(reader)
+        rows = [(row['Frame'], row['Class'], row['X'], row['Y']) for row in reader]
+
+    if not rows:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, 2))
+
+    columns = np.array(rows, dtype=float)
+    return columns[:, 0].astype(int), columns[:, 1].astype(int), columns[:, 2:4]
+
+def first_per_frame(frames):
+    """Boolean mask marking the first row of each run of equal values in a sorted frame array."""
+    mask = np.ones(len(frames), dtype=bool)
+    mask[1:] = frames[1:] != frames[:-1]
+    return mask
+
+def class_rows(sorted_classes, class_id):
+    """Slice covering the rows of one class in an array sorted by class."""
+    return slice(np.searchsorted(sorted_classes, class_id, side='left'),
+                 np.searchsorted(sorted_classes, class_id, side='right'))
+
+def assign_body_head(body_frames, body_xy, head_frames, head_xy):
+    """
+    Pick at most one body and one head point per frame for a single mouse.
+
+    Both inputs must be sorted by frame. In frames where both classes have
+    candidates, every body-head combination is scored at once and the pair
+    with the smallest distance wins. Frames with only one of the two classes
+    keep that class's first candidate.
+
+    Returns index arrays into the body and head inputs.
+    """
+    # Cross-join body and head candidates that share a frame
+    head_start = np.searchsorted(head_frames, body_frames, side='left')
+    head_count = np.searchsorted(head_frames, body_frames, side='right') - head_start
+    pair_body = np.repeat(np.arange(len(body_frames)), head_count)
+    pair_offset = np.arange(head_count.sum()) - np.repeat(np.cumsum(head_count) - head_count, head_count)
+    pair_head = np.repeat(head_start, head_count) + pair_offset
+
+    # Keep the closest pair in each frame (lexsort is stable, so ties keep input order)
+    delta = body_xy[pair_body] - head_xy[pair_head]
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    pair_frames = body_frames[pair_body]
+    order = np.lexsort((distance, pair_frames))
+    best = order[first_per_frame(pair_frames[order])]
 
-    print(f"Total input rows: {len(data)}")
+    # Frames where only one of the two classes was detected
+    body_alone = first_per_frame(body_frames) & (head_count == 0)
+    head_alone = first_per_frame(head_frames) & ~np.isin(head_frames, body_frames)
 
-    # Group data by Frame, then by Class
-    grouped_data = defaultdict(lambda: defaultdict(list))
-    for row in data:
-        frame = int(row['Frame'])
-        class_id = int(row['Class'])
-        grouped_data[frame][class_id].append((float(row['X']), float(row['Y'])))
+    body_idx = np.sort(np.concatenate([pair_body[best], np.flatnonzero(body_alone)]))
+    head_idx = np.sort(np.concatenate([pair_head[best], np.flatnonzero(head_alone)]))
+    return body_idx, head_idx
 
-    # Process data frame by frame
-    processed_data = []
+def process_csv(input_csv, output_csv, threshold=50.0, num_mice=5, layout='interleaved', store_path=None,
+                class_workers=1, verbose=True):
+    """
+    Clean one tracking CSV and return a summary dict with the input rows,
+    duplicates removed, threshold hits and output rows.
+    """
+    log = print if verbose else lambda *args, **kwargs: None
+
+    # Read the input CSV file
+    frames, classes, points = read_detections(input_csv)
+
+    log(f"Total input rows: {len(frames)}")
+
+    # Sort by Class, then Frame, keeping the original order within a frame, so
+    # each class's rows form one contiguous, frame-sorted block
+    order = np.argsort(frames, kind='stable')
+    order = order[np.argsort(classes[order], kind='stable')]
+    frames, classes, points = frames[order], classes[order], points[order]
+
+    # Dense array of frames x classes x (X, Y), NaN where a class is missing
+    class_layout = build_class_layout(num_mice, layout)
+    first_frame = int(frames.min()) if len(frames) else 0
+    num_frames = int(frames.max()) - first_frame + 1 if len(frames) else 0
+    num_classes = max(max(pair) for pair in class_layout) + 1
+    positions = np.full((num_frames, num_classes, 2), np.nan)
+
+    # Resolve duplicates mouse by mouse
     duplicate_count = 0
-    for frame, frame_data in sorted(grouped_data.items()):
-        for mouse_index in range(5):  # Assuming 5 mice
-            body_class = mouse_index * 2
-            head_class = mouse_index * 2 + 1
-
-            body_points = frame_data.get(body_class, [])
-            head_points = frame_data.get(head_class, [])
-
-            # Count duplicates
-            duplicate_count += len(body_points) - 1 if body_points else 0
-            duplicate_count += len(head_points) - 1 if head_points else 0
-
-            # Handle body points
-            if body_points:
-                if len(body_points) > 1:
-                    if head_points:
-                        head_point = head_points[0]  # Use the first head point as reference
-                        body_point = min(body_points, key=lambda p: ((p[0]-head_point[0])**2 + (p[1]-head_point[1])**2)**0.5)
-                    else:
-                        body_point = body_points[0]  # If no head point, use the first body point
-                else:
-                    body_point = body_points[0]
-
-                processed_data.append({
-                    'Frame': frame,
-                    'ID': f'Class_{body_class}',
-                    'Class': body_class,
-                    'X': body_point[0],
-                    'Y': body_point[1]
-                })
-
-            # Handle head points
-            if head_points:
-                if len(head_points) > 1:
-                    if body_points:
-                        body_point = body_points[0]  # Use the first body point as reference
-                        head_point = min(head_points, key=lambda p: ((p[0]-body_point[0])**2 + (p[1]-body_point[1])**2)**0.5)
-                    else:
-                        head_point = head_points[0]  # If no body point, use the first head point
-                else:
-                    head_point = head_points[0]
-
-                processed_data.append({
-                    'Frame': frame,
-                    'ID': f'Class_{head_class}',
-                    'Class': head_class,
-                    'X': head_point[0],
-                    'Y': head_point[1]
-                })
-
-    print(f"Rows after initial processing: {len(processed_data)}")
-    print(f"Duplicates removed: {duplicate_count}")
-
-    # Sort processed data by Frame, then by Class
-    processed_data.sort(key=lambda x: (x['Frame'], x['Class']))
+    for body_class, head_class in class_layout:
+        body_rows = class_rows(classes, body_class)
+        head_rows = class_rows(classes, head_class)
+        body_frames, body_points = frames[body_rows], points[body_rows]
+        head_frames, head_points = frames[head_rows], points[head_rows]
+
+        body_idx, head_idx = assign_body_head(body_frames, body_points, head_frames, head_points)
+
+        # Count duplicates
+        duplicate_count += len(body_frames) - len(body_idx)
+        duplicate_count += len(head_frames) - len(head_idx)
+
+        positions[body_frames[body_idx] - first_frame, body_class] = body_points[body_idx]
+        positions[head_frames[head_idx] - first_frame, head_class] = head_points[head_idx]
+
+    log(f"Rows after initial processing: {np.count_nonzero(~np.isnan(positions[..., 0]))}")
+    log(f"Duplicates removed: {duplicate_count}")
 
     # Interpolate missing frames and apply threshold
-    interpolated_data = interpolate_and_threshold(processed_data, threshold)
+    positions, threshold_hits = interpolate_and_threshold(positions, threshold, first_frame, class_workers, verbose)
+
+    # Write processed and interpolated data to CSV, sorted by Frame, then by Class
+    frame_idx, class_ids = np.nonzero(~np.isnan(positions[..., 0]))
+    interpolated_points = positions[frame_idx, class_ids]
 
-    print(f"Rows after interpolation and thresholding: {len(interpolated_data)}")
+    log(f"Rows after interpolation and thresholding: {len(frame_idx)}")
 
-    # Write processed and interpolated data to CSV
     with open(output_csv, 'w', newline='') as outfile:
-        fieldnames = ['Frame', 'ID', 'Class', 'X', 'Y']
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(interpolated_data)
-
-    print(f"Output CSV rows: {len(interpolated_data)}")
-
-def interpolate_and_threshold(data, threshold):
-    # Group data by Class
-    grouped_data = defaultdict(list)
-    for row in data:
-        grouped_data[row['Class']].append(row)
-
-    interpolated_data = []
-
-    for class_id, class_data in grouped_data.items():
-        frames = np.array([row['Frame'] for row in class_data])
-        x_values = np.array([float(row['X']) for row in class_data])
-        y_values = np.array([float(row['Y']) for row in class_data])
-
-        # Create a full range of frames
-        full_frames = np.arange(frames.min(), frames.max() + 1)
-
-        # Interpolate X and Y values
-        x_interp = np.interp(full_frames, frames, x_values)
-        y_interp = np.interp(full_frames, frames, y_values)
-
-        # Apply threshold to interpolated values
-        prev_x, prev_y = x_interp[0], y_interp[0]
-        for i, (frame, x, y) in enumerate(zip(full_frames, x_interp, y_interp)):
-            if i > 0:
-                if abs(x - prev_x) > threshold or abs(y - prev_y) > threshold:
-                    print(f"Class {class_id}, Frame {frame}: Threshold exceeded. Previous: ({prev_x}, {prev_y}), Current: ({x}, {y})")
-                    x, y = prev_x, prev_y
-            interpolated_data.append({
-                'Frame': int(frame),
-                'ID': f'Class_{class_id}',
-                'Class': class_id,
-                'X': x,
-                'Y': y
-            })
-            prev_x, prev_y = x, y
-
-    # Sort interpolated data by Frame, then by Class
-    interpolated_data.sort(key=lambda x: (x['Frame'], x['Class']))
-    return interpolated_data
+        writer = csv.writer(outfile)
+        writer.writerow(['Frame', 'ID', 'Class', 'X', 'Y'])
+        for frame, class_id, (x, y) in zip((frame_idx + first_frame).tolist(), class_ids.tolist(),
+                                           interpolated_points.tolist()):
+            writer.writerow([frame, f'Class_{class_id}', class_id, x, y])
+
+    log(f"Output CSV rows: {len(frame_idx)}")
+
+    # Optionally keep a memory-mappable copy for fast random access
+    if store_path:
+        write_track_store(store_path, first_frame, positions)
+        log(f"Track store saved to: {store_path}")
+
+    return {
+        'input': input_csv,
+        'input_rows': len(frames),
+        'duplicates': duplicate_count,
+        'threshold_hits': threshold_hits,
+        'output_rows': len(frame_idx),
+    }
+
+def interpolate_track(track, threshold):
+    """
+    Interpolate and threshold a single class.
+
+    `track` is a (frames, 2) array with NaN for missing values. Returns the
+    processed track and a list of (index, prev_x, prev_y, x, y) tuples for
+    every frame where the threshold was exceeded.
+    """
+    interpolated = np.full_like(track, np.nan)
+    hits = []
+    present = np.flatnonzero(~np.isnan(track[:, 0]))
+    if not len(present):
+        return interpolated, hits
+
+    # Create a full range of frames and interpolate X and Y values
+    full_frames = np.arange(present[0], present[-1] + 1)
+    x_interp = np.interp(full_frames, present, track[present, 0])
+    y_interp = np.interp(full_frames, present, track[present, 1])
+
+    # Apply threshold to interpolated values
+    x_values, y_values = x_interp.tolist(), y_interp.tolist()
+    prev_x, prev_y = x_values[0], y_values[0]
+    for i in range(1, len(x_values)):
+        x, y = x_values[i], y_values[i]
+        if abs(x - prev_x) > threshold or abs(y - prev_y) > threshold:
+            hits.append((int(full_frames[i]), prev_x, prev_y, x, y))
+            x_values[i], y_values[i] = prev_x, prev_y
+        prev_x, prev_y = x_values[i], y_values[i]
+
+    interpolated[full_frames, 0] = x_values
+    interpolated[full_frames, 1] = y_values
+    return interpolated, hits
+
+def interpolate_and_threshold(positions, threshold, first_frame=0, workers=1, verbose=True):
+    """
+    Interpolate missing frames and apply the movement threshold.
+
+    `positions` is a dense (frames, classes, 2) array with NaN for missing
+    values. Each class is interpolated between its first and last detection;
+    frames outside that span stay NaN. A point that moves more than
+    `threshold` in X or Y from the previous frame is held at the previous value.
+
+    Classes are independent, so with `workers` > 1 they are processed in a
+    process pool. Returns the processed array and the number of threshold hits.
+    """
+    tracks = [positions[:, class_id] for class_id in range(positions.shape[1])]
+    if workers > 1 and len(tracks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(interpolate_track, tracks, repeat(threshold)))
+    else:
+        results = [interpolate_track(track, threshold) for track in tracks]
+
+    interpolated = np.full_like(positions, np.nan)
+    threshold_hits = 0
+    for class_id, (track, hits) in enumerate(results):
+        interpolated[:, class_id] = track
+        threshold_hits += len(hits)
+        if verbose:
+            for frame, prev_x, prev_y, x, y in hits:
+                print(f"Class {class_id}, Frame {frame + first_frame}: Threshold exceeded. Previous: ({prev_x}, {prev_y}), Current: ({x}, {y})")
+
+    return interpolated, threshold_hits
+
+def find_input_files(pattern):
+    """Return the CSV files in a directory, or the files matching a glob pattern, sorted by name."""
+    if os.path.isdir(pattern):
+        return sorted(os.path.join(pattern, f) for f in os.listdir(pattern)
+                      if f.endswith('.csv') and not f.endswith('_processed.csv'))
+    return sorted(f for f in glob.glob(pattern) if os.path.isfile(f))
+
+def batch_output_names(input_files):
+    """
+    Return the <name>_processed.csv file name for each input. Inputs that share
+    a file name (e.g. sessions/*/tracks.csv) are prefixed with their parent
+    folder name so they do not overwrite each other.
+    """
+    stems = [os.path.splitext(os.path.basename(input_csv))[0] for input_csv in input_files]
+    counts = Counter(stems)
+    names = []
+    for input_csv, stem in zip(input_files, stems):
+        if counts[stem] > 1:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(input_csv)))
+            stem = f"{parent}_{stem}"
+        names.append(f"{stem}_processed.csv")
+
+    clashes = sorted(name for name, count in Counter(names).items() if count > 1)
+    if clashes:
+        raise ValueError(f"Several input files would be written to the same output file: {', '.join(clashes)}")
+    return names
+
+def process_batch(input_files, output_folder, threshold=50.0, num_mice=5, layout='interleaved',
+                  store=False, workers=None, class_workers=1):
+    """
+    Process many recordings in a process pool.
+
+    Each input is written to `output_folder` as <name>_processed.csv (and
+    <name>_processed.tracks if `store` is set), see batch_output_names().
+    Returns the per-file summaries in input order, each with the path it was
+    written to under 'output'.
+    """
+    output_names = batch_output_names(input_files)
+    os.makedirs(output_folder, exist_ok=True)
+    summaries = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for input_csv, output_name in zip(input_files, output_names):
+            output_csv = os.path.join(output_folder, output_name)
+            store_path = store_path_for(output_csv) if store else None
+            future = executor.submit(process_csv, input_csv, output_csv, threshold, num_mice, layout,
+                                     store_path, class_workers, False)
+            futures[future] = input_csv, output_csv
+
+        for future in as_completed(futures):
+            input_csv, output_csv = futures[future]
+            try:
+                summaries[input_csv] = dict(future.result(), output=output_csv)
+                print(f"Processed {input_csv}")
+            except Exception as e:
+                print(f"Error processing {input_csv}: {e}")
+                summaries[input_csv] = {'input': input_csv, 'output': output_csv, 'error': str(e)}
+
+    return [summaries[input_csv] for input_csv in input_files]
+
+def print_batch_summary(summaries, summary_csv=None):
+    """
+    Print a combined summary table and optionally write it to a CSV file.
+    Rows are labelled with the output file name, which is unique within a batch.
+    """
+    fieldnames = ['input', 'output', 'input_rows', 'duplicates', 'threshold_hits', 'output_rows']
+    done = [summary for summary in summaries if 'error' not in summary]
+    totals = {'input': 'TOTAL', 'output': 'TOTAL'}
+    for key in fieldnames[2:]:
+        totals[key] = sum(summary[key] for summary in done)
+
+    print(f"{'Output file':<40} {'Input rows':>12} {'Duplicates':>12} {'Threshold':>12} {'Output rows':>12}")
+    for summary in done + [totals]:
+        print(f"{os.path.basename(summary['output']):<40} {summary['input_rows']:>12} {summary['duplicates']:>12} "
+              f"{summary['threshold_hits']:>12} {summary['output_rows']:>12}")
+    failed = len(summaries) - len(done)
+    if failed:
+        print(f"Failed files: {failed}")
+
+    if summary_csv:
+        with open(summary_csv, 'w', newline='') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=fieldnames + ['error'])
+            writer.writeheader()
+            writer.writerows(summaries + [totals])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process CSV file for mouse tracking data.")
-    parser.add_argument("input_csv", help="Path to the input CSV file")
-    parser.add_argument("output_csv", help="Path to the output CSV file")
+    parser.add_argument("input_csv", help="Path to the input CSV file, or a directory / quoted glob pattern for batch mode")
+    parser.add_argument("output_csv", help="Path to the output CSV file (output folder in batch mode)")
     parser.add_argument("-t", "--threshold", type=float, default=500.0,
                         help="Threshold for interpolation (default: 500.0)")
+    parser.add_argument("-n", "--num-mice", type=int, default=5,
+                        help="Number of mice in the recording (default: 5)")
+    parser.add_argument("-l", "--layout", choices=CLASS_LAYOUTS, default='interleaved',
+                        help="How body/head classes are numbered: 'interleaved' (0,1),(2,3),... "
+                             "or 'blocked' bodies 0..N-1, heads N..2N-1 (default: interleaved)")
+    parser.add_argument("-s", "--store", action="store_true",
+                        help="Also write a memory-mappable track store (.tracks) next to the output CSV")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of files processed in parallel in batch mode (default: number of CPUs)")
+    parser.add_argument("-c", "--class-jobs", type=int, default=1,
+                        help="Number of processes used to interpolate classes within one file (default: 1)")
+    parser.add_argument("--summary-csv", help="Path for the combined summary CSV file in batch mode")
     args = parser.parse_args()
 
-    process_csv(args.input_csv, args.output_csv, args.threshold)
+    # An existing file is always processed on its own, even if its name contains glob characters
+    if not os.path.isfile(args.input_csv) and (os.path.isdir(args.input_csv) or glob.escape(args.input_csv) != args.input_csv):
+        input_files = find_input_files(args.input_csv)
+        print(f"Found {len(input_files)} CSV files")
+        try:
+            summaries = process_batch(input_files, args.output_csv, args.threshold, args.num_mice, args.layout,
+                                      args.store, args.jobs, args.class_jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        print_batch_summary(summaries, args.summary_csv)
+    else:
+        store_path = store_path_for(args.output_csv) if args.store else None
+        process_csv(args.input_csv, args.output_csv, args.threshold, args.num_mice, args.layout, store_path,
+                    args.class_jobs)
@@ -1,6 +1,7 @@
 import os
 import csv
 import argparse
+import numpy as np
 from moviepy.editor import VideoFileClip, concatenate_videoclips
 import re
 
@@ -23,12 +24,98 @@ def merge_videos(input_folder, output_video):
     final_clip = concatenate_videoclips(clips)
     final_clip.write_videofile(output_video)
 
-def merge_csv_files(input_folder, output_csv):
-    """Merge CSV files into a single CSV file with continuous frame numbers."""
+def track_endpoints(segment_data, first):
+    """
+    Return {track ID: (frame, class, x, y)} for the first (or last) row of each
+    track in a segment.
+    """
+    endpoints = {}
+    rows = segment_data if first else reversed(segment_data)
+    for row in rows:
+        if row['ID'] not in endpoints:
+            endpoints[row['ID']] = (int(row['Frame']), int(row['Class']), float(row['X']), float(row['Y']))
+    return endpoints
+
+def match_tracks(ending, starting, max_distance):
+    """
+    Match tracks ending in one segment to tracks starting in the next.
+
+    Only tracks of the same class closer than `max_distance` can match; pairs
+    are accepted closest first, each track being used at most once.
+    Returns {starting ID: ending ID}.
+    """
+    if not ending or not starting:
+        return {}
+
+    end_ids, end_info = list(ending), np.array(list(ending.values()))
+    start_ids, start_info = list(starting), np.array(list(starting.values()))
+
+    # Cost matrix of end x start distances, infinite across classes
+    delta = end_info[:, None, 2:4] - start_info[None, :, 2:4]
+    cost = np.hypot(delta[..., 0], delta[..., 1])
+    cost[end_info[:, None, 1] != start_info[None, :, 1]] = np.inf
+
+    matches = {}
+    used_ends = set()
+    for flat_index in np.argsort(cost, axis=None):
+        end_index, start_index = np.unravel_index(flat_index, cost.shape)
+        if cost[end_index, start_index] > max_distance:
+            break
+        if end_index in used_ends or start_ids[start_index] in matches:
+            continue
+        matches[start_ids[start_index]] = end_ids[end_index]
+        used_ends.add(end_index)
+    return matches
+
+def stitch_track_ids(segments, max_distance=50.0, window=5):
+    """
+    Give tracks consistent IDs across segments.
+
+    Every segment is tracked independently, so its IDs restart. Tracks still
+    present in the last `window` frames of a segment are matched by class and
+    position to tracks present in the first `window` frames of the next one
+    and keep the same global ID; all other tracks get a new, unused ID.
+    Segments are lists of row dicts with frame numbers already made continuous;
+    their ID column is rewritten in place.
+    """
+    next_id = 0
+    previous_ending = {}
+
+    for segment_data in segments:
+        if not segment_data:
+            continue
+
+        frames = [int(row['Frame']) for row in segment_data]
+        first_frame, last_frame = min(frames), max(frames)
+
+        starting = {track_id: info for track_id, info in track_endpoints(segment_data, first=True).items()
+                    if info[0] <= first_frame + window}
+        matches = match_tracks(previous_ending, starting, max_distance)
+
+        # Map local IDs to global IDs, continuing matched tracks
+        id_map = {}
+        for row in segment_data:
+            local_id = row['ID']
+            if local_id not in id_map:
+                if local_id in matches:
+                    id_map[local_id] = matches[local_id]
+                else:
+                    id_map[local_id] = next_id
+                    next_id += 1
+            row['ID'] = id_map[local_id]
+
+        previous_ending = {track_id: info for track_id, info in track_endpoints(segment_data, first=False).items()
+                           if info[0] >= last_frame - window}
+
+def merge_csv_files(input_folder, output_csv, stitch=True, max_distance=50.0, window=5):
+    """
+    Merge CSV files into a single CSV file with continuous frame numbers.
+    With `stitch`, track IDs are also made continuous across segments.
+    """
     csv_files = [f for f in os.listdir(input_folder) if f.endswith('_output.csv')]
     csv_files = sort_files(csv_files)
     
-    all_data = []
+    segments = []
     last_frame = -1  # Initialize last_frame to -1
     
     for csv_file in csv_files:
@@ -41,12 +128,17 @@ def merge_csv_files(input_folder, output_csv):
                 new_frame = int(row['Frame']) + last_frame + 1
                 row['Frame'] = str(new_frame)
             
-            all_data.extend(segment_data)
+            segments.append(segment_data)
             
             # Update last_frame for the next segment
             if segment_data:
                 last_frame = int(segment_data[-1]['Frame'])
     
+    if stitch:
+        stitch_track_ids(segments, max_distance, window)
+
+    all_data = [row for segment_data in segments for row in segment_data]
+
     # Sort all data by frame number (should already be in order, but just to be safe)
     all_data.sort(key=lambda x: int(x['Frame']))
     
@@ -63,11 +155,17 @@ def main():
     parser.add_argument("input_folder", help="Path to the folder containing processed video segments and CSV files")
     parser.add_argument("output_video", help="Path for the output merged video file")
     parser.add_argument("output_csv", help="Path for the output merged CSV file")
+    parser.add_argument("--no-stitch", action="store_true",
+                        help="Keep each segment's own track IDs instead of stitching them across segments")
+    parser.add_argument("--stitch-distance", type=float, default=50.0,
+                        help="Maximum distance in pixels between a track's end and its continuation (default: 50.0)")
+    parser.add_argument("--stitch-window", type=int, default=5,
+                        help="Frames at each segment boundary in which tracks can be stitched (default: 5)")
     
     args = parser.parse_args()
     
     merge_videos(args.input_folder, args.output_video)
-    merge_csv_files(args.input_folder, args.output_csv)
+    merge_csv_files(args.input_folder, args.output_csv, not args.no_stitch, args.stitch_distance, args.stitch_window)
     
     print(f"Merged video saved to: {args.output_video}")
     print(f"Merged CSV saved to: {args.output_csv}")
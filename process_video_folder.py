@@ -6,33 +6,47 @@ from IPython.display import clear_output
 import os
 import argparse
 
-def process_video_folder(model_path, segments_folder):
-    # Load the YOLOv10 model
-    model = YOLOv10(model_path)
+def reset_tracker(model):
+    """Clear the tracks a reused model kept from the previous video (no-op before its first track() call)."""
+    predictor = getattr(model, 'predictor', None)
+    for tracker in getattr(predictor, 'trackers', []):
+        tracker.reset()
+
+def process_video(model, video_path, output_folder, progress=None):
+    """
+    Track a single video with an already loaded model.
+
+    Writes <name>_output.mp4 and <name>_output.csv to `output_folder`. If
+    `progress` is given it is called as progress(frame_count, total_frames)
+    after every frame instead of showing a progress bar.
+    """
+    video_file = os.path.basename(video_path)
+
+    # Open the video file
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        raise ValueError(f"Could not open video {video_path}")
 
-    # Get a list of all video files in the segments folder
-    video_files = [f for f in os.listdir(segments_folder) if f.endswith('.mp4')]
+    # Get video properties
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
 
-    # Loop through each video segment
-    for video_file in video_files:
-        # Construct the full path to the video segment
-        video_path = os.path.join(segments_folder, video_file)
+    # Define the codec and create VideoWriter object, using the original video filename with "_output" appended
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    output_video_path = os.path.join(output_folder, f"{os.path.splitext(video_file)[0]}_output.mp4")
 
-        # Open the video file
-        cap = cv2.VideoCapture(video_path)
+    # Prepare CSV file, using the original video filename with "_output.csv" appended
+    csv_path = os.path.join(output_folder, f"{os.path.splitext(video_file)[0]}_output.csv")
 
-        # Get video properties
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+    # Tracks from a previous video on this model must not carry over
+    reset_tracker(model)
 
-        # Define the codec and create VideoWriter object, using the original video filename with "_output" appended
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        output_video_path = os.path.join(segments_folder, f"{os.path.splitext(video_file)[0]}_output.mp4")
+    out = None
+    csv_file = None
+    try:
         out = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
-
-        # Prepare CSV file, using the original video filename with "_output.csv" appended
-        csv_path = os.path.join(segments_folder, f"{os.path.splitext(video_file)[0]}_output.csv")
         csv_file = open(csv_path, 'w', newline='')
         csv_writer = csv.writer(csv_file)
         csv_writer.writerow(['Frame', 'ID', 'Class', 'X', 'Y'])
@@ -41,12 +55,12 @@ def process_video_folder(model_path, segments_folder):
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
         # Loop through the video frames with progress bar
-        with tqdm(total=total_frames, desc=f"Processing {video_file}", unit="frame") as pbar:
+        with tqdm(total=total_frames, desc=f"Processing {video_file}", unit="frame", disable=progress is not None) as pbar:
             while cap.isOpened():
                 # Read a frame from the video
                 success, frame = cap.read()
                 if success:
-                    # Run YOLOv10 tracking on the frame, persisting tracks between frames
+                    # Run YOLOv10 tracking on the frame, persisting tracks between frames of this video
                     results = model.track(frame, persist=True)
 
                     # Visualize the results on the frame
@@ -68,8 +82,10 @@ def process_video_folder(model_path, segments_folder):
                     frame_count += 1
                     pbar.update(1)  # Update the progress bar
 
-                    # Print processing time information (optional), clearing previous output
-                    if results[0].boxes.id is not None:
+                    if progress is not None:
+                        progress(frame_count, total_frames)
+                    elif results[0].boxes.id is not None:
+                        # Print processing time information (optional), clearing previous output
                         clear_output(wait=True)  # Clear previous output
                         print(f"Frame {frame_count}/{total_frames}")
 
@@ -77,10 +93,36 @@ def process_video_folder(model_path, segments_folder):
                     # Break the loop if the end of the video is reached
                     break
 
+        if frame_count == 0:
+            raise ValueError(f"No frames could be read from {video_path}")
+    finally:
         # Release the video capture and writer objects
         cap.release()
-        out.release()
-        csv_file.close()
+        if out is not None:
+            out.release()
+        if csv_file is not None:
+            csv_file.close()
+
+    return output_video_path, csv_path
+
+def process_video_folder(model_path, segments_folder):
+    # Load the YOLOv10 model
+    model = YOLOv10(model_path)
+
+    # Get a list of all video files in the segments folder
+    video_files = [f for f in os.listdir(segments_folder) if f.endswith('.mp4')]
+
+    # Loop through each video segment
+    for video_file in video_files:
+        # Construct the full path to the video segment
+        video_path = os.path.join(segments_folder, video_file)
+
+        # A segment that cannot be read is reported and skipped, so the rest of the folder still runs
+        try:
+            _, csv_path = process_video(model, video_path, segments_folder)
+        except ValueError as e:
+            print(f"Skipping {video_file}: {e}")
+            continue
 
         print(f"Video processing completed for {video_file}. Output saved.")
         print(f"Tracking data saved as '{csv_path}'.")
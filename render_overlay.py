@@ -0,0 +1,207 @@
+import os
+import shutil
+import argparse
+import tempfile
+import subprocess
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from track_analysis import build_class_layout
+from track_store import STORE_EXTENSION, csv_to_track_store, open_track_store
+
+# Frames decoded before a chunk's first frame to check where the seek landed
+SEEK_PREROLL_FRAMES = 1
+
+def mouse_colors(num_mice):
+    """One distinct BGR color per mouse, spread around the hue circle."""
+    hues = np.linspace(0, 180, num_mice, endpoint=False).astype(np.uint8)
+    hsv = np.stack([hues, np.full(num_mice, 255, np.uint8), np.full(num_mice, 255, np.uint8)], axis=1)
+    return [tuple(int(c) for c in color) for color in cv2.cvtColor(hsv[None], cv2.COLOR_HSV2BGR)[0]]
+
+def draw_frame(frame, points, class_layout, colors, radius=6):
+    """
+    Draw body/head markers, a body-to-head line and a label for every mouse.
+    `points` is a (classes, 2) array of positions for this frame, NaN where missing.
+    """
+    num_classes = len(points)
+    for mouse_index, (body_class, head_class) in enumerate(class_layout):
+        color = colors[mouse_index]
+        body = points[body_class] if body_class < num_classes else (np.nan, np.nan)
+        head = points[head_class] if head_class < num_classes else (np.nan, np.nan)
+        has_body = not np.isnan(body[0])
+        has_head = not np.isnan(head[0])
+
+        if has_body and has_head:
+            cv2.line(frame, (int(body[0]), int(body[1])), (int(head[0]), int(head[1])), color, 2)
+        if has_body:
+            cv2.circle(frame, (int(body[0]), int(body[1])), radius, color, -1)
+            cv2.putText(frame, f"Mouse {mouse_index}", (int(body[0]) + radius, int(body[1]) - radius),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+        if has_head:
+            cv2.circle(frame, (int(head[0]), int(head[1])), radius, color, 2)
+
+def seek_to_frame(cap, start, fps):
+    """
+    Position `cap` so the next read() returns frame `start`.
+
+    Seeks just before `start` and decodes forward with grab(), then
+    checks the timestamp of the last decoded frame, which must be frame
+    start - 1. Raises ValueError if the video cannot be seeked frame-accurately
+    (e.g. variable frame rate), since frames would not line up with tracks.
+    """
+    if start == 0:
+        return
+    if fps <= 0:
+        raise ValueError(f"Cannot seek to frame {start}: the video reports no frame rate")
+    cap.set(cv2.CAP_PROP_POS_FRAMES, max(start - SEEK_PREROLL_FRAMES, 0))
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if not 0 <= position < start:
+        raise ValueError(f"Seeking to frame {start} landed on frame {position}")
+    while position < start:
+        if not cap.grab():
+            raise ValueError(f"Video ended at frame {position} while seeking to frame {start}")
+        position += 1
+
+    expected_msec = (start - 1) * 1000.0 / fps
+    actual_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if abs(actual_msec - expected_msec) > 500.0 / fps:
+        raise ValueError(f"Could not seek to frame {start} accurately (frame {start - 1} is at {actual_msec:.0f} ms "
+                         f"instead of {expected_msec:.0f} ms); re-encode the video at a constant frame rate or use -j 1")
+
+def render_chunk(video_path, store_path, chunk_path, start, end, class_layout, frame_offset=0):
+    """
+    Render video frames start..end-1 with their tracks into `chunk_path`.
+    Runs in a worker process; tracks are read from the memory-mapped store.
+    Returns the number of frames written, which is lower than end - start
+    only if the video ends early.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {video_path}")
+    out = None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        seek_to_frame(cap, start, fps)
+
+        out = cv2.VideoWriter(chunk_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+        store = open_track_store(store_path)
+        colors = mouse_colors(len(class_layout))
+
+        empty = np.full((store.num_classes, 2), np.nan)
+
+        frames_written = 0
+        for frame_index in range(start, end):
+            success, frame = cap.read()
+            if not success:
+                break
+
+            # Video frame i shows track frame i + frame_offset
+            track_index = frame_index + frame_offset - store.first_frame
+            points = store.positions[track_index] if 0 <= track_index < store.num_frames else empty
+            draw_frame(frame, points, class_layout, colors)
+            out.write(frame)
+            frames_written += 1
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+
+    return frames_written
+
+def concat_chunks(chunk_paths, output_video):
+    """Join chunk files into one video with ffmpeg's concat demuxer, without re-encoding."""
+    list_path = os.path.join(os.path.dirname(chunk_paths[0]), 'chunks.txt')
+    with open(list_path, 'w') as f:
+        for chunk_path in chunk_paths:
+            f.write(f"file '{os.path.abspath(chunk_path)}'\n")
+
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                    '-i', list_path, '-c', 'copy', output_video], check=True)
+
+def render_overlay(video_path, tracks_path, output_video, num_mice=5, layout='interleaved',
+                   workers=None, frame_offset=0):
+    """
+    Draw tracks from a processed CSV (or .tracks store) onto the source video.
+
+    The video is split into one frame range per worker; ranges are rendered in
+    parallel processes and then joined without re-encoding with ffmpeg, which
+    must be on PATH.
+    """
+    # Fail before rendering rather than after, when the chunks would be thrown away
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg was not found on PATH; it is needed to join the rendered chunks")
+
+    workers = workers or os.cpu_count() or 1
+    class_layout = build_class_layout(num_mice, layout)
+
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if total_frames <= 0:
+        raise ValueError(f"Could not read frame count from {video_path}")
+
+    temp_folder = tempfile.mkdtemp(prefix='overlay_')
+    try:
+        # Workers memory-map the tracks instead of each parsing the CSV
+        if tracks_path.endswith(STORE_EXTENSION):
+            store_path = tracks_path
+        else:
+            store_path = csv_to_track_store(tracks_path, os.path.join(temp_folder, 'tracks' + STORE_EXTENSION))
+
+        bounds = np.linspace(0, total_frames, min(workers, total_frames) + 1).astype(int)
+        chunk_paths = [os.path.join(temp_folder, f"chunk_{i:04d}.mp4") for i in range(len(bounds) - 1)]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(render_chunk, video_path, store_path, chunk_path, start, end, class_layout, frame_offset): (start, end)
+                for chunk_path, start, end in zip(chunk_paths, bounds[:-1], bounds[1:])
+            }
+            done = 0
+            frames_written_by_start = {}
+            for future in as_completed(futures):
+                start, end = futures[future]
+                frames_written = frames_written_by_start[start] = future.result()
+                if frames_written != end - start:
+                    if end < total_frames:
+                        raise RuntimeError(f"Chunk for frames {start}-{end - 1} stopped after {frames_written} frames")
+                    # The frame count in the header can overestimate the length of the video
+                    print(f"Video ended at frame {start + frames_written}, before the {total_frames} frames it reports")
+                done += 1
+                print(f"Rendered chunk {done}/{len(futures)}")
+
+        # A final chunk that starts past the real end of the video is empty
+        chunk_paths = [chunk_path for chunk_path, start in zip(chunk_paths, bounds[:-1])
+                       if frames_written_by_start[start] > 0]
+        if not chunk_paths:
+            raise ValueError(f"No frames could be read from {video_path}")
+        concat_chunks(chunk_paths, output_video)
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render tracking data onto the source video in parallel.")
+    parser.add_argument("video_path", help="Path to the source video file")
+    parser.add_argument("tracks_path", help="Path to the processed CSV file or .tracks store")
+    parser.add_argument("output_video", help="Path for the output overlay video")
+    parser.add_argument("-n", "--num-mice", type=int, default=5,
+                        help="Number of mice in the recording (default: 5)")
+    parser.add_argument("-l", "--layout", choices=('interleaved', 'blocked'), default='interleaved',
+                        help="How body/head classes are numbered (default: interleaved)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of parallel render processes (default: number of CPUs)")
+    parser.add_argument("--frame-offset", type=int, default=0,
+                        help="Track frame number shown on video frame 0, e.g. 1 for CSVs exported from Blender (default: 0)")
+
+    args = parser.parse_args()
+
+    try:
+        render_overlay(args.video_path, args.tracks_path, args.output_video, args.num_mice, args.layout,
+                       args.jobs, args.frame_offset)
+    except (RuntimeError, ValueError) as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    print(f"Overlay video saved to: {args.output_video}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import csv
+import os
+import glob
+import json
+import hashlib
+import argparse
+import numpy as np
+from track_store import STORE_EXTENSION, open_track_store
+
+def build_class_layout(num_mice=5, layout='interleaved'):
+    """
+    Returns a list of (body_class, head_class) pairs, one per mouse.
+    Uses the same numbering schemes as csv-processor-cli.py.
+    """
+    if layout == 'interleaved':
+        return [(mouse_index * 2, mouse_index * 2 + 1) for mouse_index in range(num_mice)]
+    if layout == 'blocked':
+        return [(mouse_index, mouse_index + num_mice) for mouse_index in range(num_mice)]
+    raise ValueError(f"Unknown class layout: {layout}")
+
+def load_positions(input_csv, num_mice=5, layout='interleaved'):
+    """
+    Load a processed tracking CSV (or a .tracks store) into dense arrays.
+
+    Returns:
+        frames (ndarray): Frame numbers, shape (F,)
+        body (ndarray): Body positions, shape (F, num_mice, 2), NaN where missing
+        head (ndarray): Head positions, shape (F, num_mice, 2), NaN where missing
+    """
+    class_layout = build_class_layout(num_mice, layout)
+    if input_csv.endswith(STORE_EXTENSION):
+        return load_store_positions(input_csv, class_layout)
+
+    with open(input_csv, 'r') as infile:
+        reader = csv.DictReader(infile)
+        rows = [(row['Frame'], row['Class'], row['X'], row['Y']) for row in reader]
+
+    if not rows:
+        empty = np.empty((0, num_mice, 2))
+        return np.empty(0, dtype=int), empty, empty.copy()
+
+    columns = np.array(rows, dtype=float)
+    frame_ids = columns[:, 0].astype(int)
+    class_ids = columns[:, 1].astype(int)
+
+    first_frame = frame_ids.min()
+    frames = np.arange(first_frame, frame_ids.max() + 1)
+
+    # Map each class ID to its (part, mouse) slot; unknown classes are dropped
+    slot = np.full(max(class_ids.max(), max(max(pair) for pair in class_layout)) + 1, -1)
+    for mouse_index, (body_class, head_class) in enumerate(class_layout):
+        slot[body_class] = mouse_index
+        slot[head_class] = num_mice + mouse_index
+
+    positions = np.full((len(frames), 2 * num_mice, 2), np.nan)
+    known = slot[class_ids] >= 0
+    positions[frame_ids[known] - first_frame, slot[class_ids[known]]] = columns[known, 2:4]
+
+    return frames, positions[:, :num_mice], positions[:, num_mice:]
+
+def load_store_positions(store_path, class_layout):
+    """Read body and head positions for each mouse from a memory-mapped track store."""
+    store = open_track_store(store_path)
+    padded = np.full((store.num_frames, 2), np.nan)
+
+    def column(class_id):
+        return store.positions[:, class_id] if class_id < store.num_classes else padded
+
+    body = np.stack([column(body_class) for body_class, _ in class_layout], axis=1).astype(float)
+    head = np.stack([column(head_class) for _, head_class in class_layout], axis=1).astype(float)
+    return store.frames, body, head
+
+def find_bouts(mask, min_length=1):
+    """
+    Find runs of True values along the first axis of a boolean array.
+
+    Returns an array of (column, start_index, end_index) rows, end inclusive,
+    keeping only runs of at least `min_length` entries.
+    """
+    mask = mask.reshape(mask.shape[0], int(np.prod(mask.shape[1:])))
+    padded = np.zeros((mask.shape[0] + 2, mask.shape[1]), dtype=np.int8)
+    padded[1:-1] = mask
+    edges = np.diff(padded, axis=0)
+
+    # Starts and ends come out in the same (column-major) order
+    start_col, start_row = np.nonzero(edges.T == 1)
+    _, end_row = np.nonzero(edges.T == -1)
+    keep = end_row - start_row >= min_length
+    return np.column_stack([start_col[keep], start_row[keep], end_row[keep] - 1])
+
+def compute_kinematics(body, head, fps=30.0):
+    """
+    Per-mouse kinematics from dense body/head positions.
+
+    Returns:
+        speed (ndarray): Body speed in pixels per second, shape (F, M); the first frame is NaN
+        distance (ndarray): Total distance travelled by the body in pixels, shape (M,)
+        heading (ndarray): Body-to-head angle in degrees, shape (F, M), in image
+            coordinates (0 = +X, 90 = +Y, i.e. pointing down the frame)
+    """
+    step = np.hypot(*np.moveaxis(np.diff(body, axis=0), -1, 0))
+    speed = np.full(body.shape[:2], np.nan)
+    speed[1:] = step * fps
+    distance = np.nansum(step, axis=0)
+
+    direction = head - body
+    heading = np.degrees(np.arctan2(direction[..., 1], direction[..., 0]))
+    return speed, distance, heading
+
+def compute_social(body, contact_distance=50.0, min_bout_frames=5):
+    """
+    Pairwise inter-mouse body distances and contact bouts.
+
+    Returns:
+        pairs (ndarray): Mouse index pairs, shape (P, 2)
+        pair_distance (ndarray): Body-to-body distance per frame and pair, shape (F, P)
+        bouts (ndarray): Contact bouts as (mouse_a, mouse_b, start_index, end_index) rows
+    """
+    first, second = np.triu_indices(body.shape[1], k=1)
+    pairs = np.column_stack([first, second])
+    delta = body[:, first] - body[:, second]
+    pair_distance = np.hypot(delta[..., 0], delta[..., 1]).astype(np.float32)
+
+    # NaN distances compare as False, so missing frames break a bout
+    contact = pair_distance < contact_distance
+    runs = find_bouts(contact, min_bout_frames)
+    bouts = np.column_stack([pairs[runs[:, 0]], runs[:, 1:]]) if len(runs) else np.empty((0, 4), dtype=int)
+    return pairs, pair_distance, bouts
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(input_csv, stage, params, input_digest):
+    """
+    Path of the cached `stage` results for `input_csv`, stored next to it and
+    keyed by the hash of its contents and the parameters of that stage.
+    """
+    digest = hashlib.sha256()
+    digest.update(input_digest.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return f"{os.path.splitext(input_csv)[0]}_{stage}_{digest.hexdigest()[:16]}.npz"
+
+def remove_stale_caches(input_csv, stage, keep_path=None):
+    """Delete cache files of `stage` for `input_csv` other than `keep_path`."""
+    pattern = f"{glob.escape(os.path.splitext(input_csv)[0])}_{stage}_{'[0-9a-f]' * 16}.npz"
+    for path in glob.glob(pattern):
+        if path != keep_path:
+            os.remove(path)
+
+def cached_stage(input_csv, stage, params, input_digest, compute):
+    """
+    Return the results of one analysis stage from its cache file, or run
+    `compute` and replace any older cache file of that stage with the result.
+    """
+    result_path = cache_path(input_csv, stage, params, input_digest)
+    if os.path.exists(result_path):
+        print(f"Using cached {stage}: {result_path}")
+        with np.load(result_path) as cached:
+            return dict(cached)
+
+    results = compute()
+    np.savez_compressed(result_path, **results)
+    remove_stale_caches(input_csv, stage, result_path)
+    print(f"{stage.capitalize()} cached to: {result_path}")
+    return results
+
+def analyze_session(input_csv, fps=30.0, num_mice=5, layout='interleaved',
+                    contact_distance=50.0, min_bout_frames=5, use_cache=True):
+    """
+    Compute kinematics and social-interaction measures for a processed CSV.
+
+    Kinematics and social results are cached separately next to the input as
+    compressed .npz files, each keyed by the input contents and only the
+    parameters it depends on, so changing the contact settings reuses the
+    cached kinematics. Each stage keeps one cache file per input.
+
+    Returns a dict of numpy arrays: frames, speed, distance, heading, pairs,
+    pair_distance and bouts (bout start/end given as frame numbers).
+    """
+    loaded = []
+
+    def positions():
+        # Only parse the input if a stage actually has to be computed
+        if not loaded:
+            loaded.append(load_positions(input_csv, num_mice, layout))
+        return loaded[0]
+
+    def kinematics():
+        frames, body, head = positions()
+        speed, distance, heading = compute_kinematics(body, head, fps)
+        return {'frames': frames, 'speed': speed, 'distance': distance, 'heading': heading}
+
+    def social():
+        frames, body, _ = positions()
+        pairs, pair_distance, bouts = compute_social(body, contact_distance, min_bout_frames)
+        if len(frames):
+            bouts[:, 2:] = frames[bouts[:, 2:]]
+        return {'pairs': pairs, 'pair_distance': pair_distance, 'bouts': bouts}
+
+    if not use_cache:
+        return {**kinematics(), **social()}
+
+    input_digest = file_digest(input_csv)
+    kinematics_params = {'fps': fps, 'num_mice': num_mice, 'layout': layout}
+    social_params = {
+        'num_mice': num_mice,
+        'layout': layout,
+        'contact_distance': contact_distance,
+        'min_bout_frames': min_bout_frames,
+    }
+    results = cached_stage(input_csv, 'kinematics', kinematics_params, input_digest, kinematics)
+    results.update(cached_stage(input_csv, 'social', social_params, input_digest, social))
+
+    # Single-file caches written by earlier versions
+    remove_stale_caches(input_csv, 'analysis')
+    return results
+
+def write_summary(results, summary_csv, fps=30.0):
+    """Write per-mouse totals (distance, mean speed, contact time) to a CSV file."""
+    num_mice = len(results['distance'])
+    bouts = results['bouts']
+    bout_frames = bouts[:, 3] - bouts[:, 2] + 1
+    contact_frames = np.zeros(num_mice, dtype=int)
+    np.add.at(contact_frames, bouts[:, 0], bout_frames)
+    np.add.at(contact_frames, bouts[:, 1], bout_frames)
+    bout_counts = np.bincount(bouts[:, :2].ravel(), minlength=num_mice)
+
+    with open(summary_csv, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['Mouse', 'Distance', 'MeanSpeed', 'ContactBouts', 'ContactSeconds'])
+        for mouse_index in range(num_mice):
+            writer.writerow([
+                mouse_index,
+                results['distance'][mouse_index],
+                np.nanmean(results['speed'][:, mouse_index]) if len(results['speed']) else np.nan,
+                bout_counts[mouse_index],
+                contact_frames[mouse_index] / fps,
+            ])
+
+def write_bouts(results, bouts_csv):
+    """Write contact bouts as one row per bout to a CSV file."""
+    with open(bouts_csv, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['MouseA', 'MouseB', 'StartFrame', 'EndFrame'])
+        writer.writerows(results['bouts'].tolist())
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute kinematics and social interactions from processed tracking data.")
+    parser.add_argument("input_csv", help="Path to the processed CSV file (output of csv-processor-cli.py) or its .tracks store")
+    parser.add_argument("--fps", type=float, default=30.0,
+                        help="Frame rate of the recording (default: 30.0)")
+    parser.add_argument("-n", "--num-mice", type=int, default=5,
+                        help="Number of mice in the recording (default: 5)")
+    parser.add_argument("-l", "--layout", choices=('interleaved', 'blocked'), default='interleaved',
+                        help="How body/head classes are numbered (default: interleaved)")
+    parser.add_argument("-c", "--contact-distance", type=float, default=50.0,
+                        help="Body-to-body distance in pixels below which two mice are in contact (default: 50.0)")
+    parser.add_argument("-m", "--min-bout-frames", type=int, default=5,
+                        help="Minimum number of consecutive contact frames for a bout (default: 5)")
+    parser.add_argument("--summary-csv", help="Path for the per-mouse summary CSV file")
+    parser.add_argument("--bouts-csv", help="Path for the contact bouts CSV file")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute even if a cached result exists")
+
+    args = parser.parse_args()
+
+    results = analyze_session(args.input_csv, args.fps, args.num_mice, args.layout,
+                              args.contact_distance, args.min_bout_frames, not args.no_cache)
+
+    print(f"Frames analyzed: {len(results['frames'])}")
+    for mouse_index, distance in enumerate(results['distance']):
+        print(f"Mouse {mouse_index}: distance travelled {distance:.1f} px")
+    print(f"Contact bouts: {len(results['bouts'])}")
+
+    if args.summary_csv:
+        write_summary(results, args.summary_csv, args.fps)
+        print(f"Summary saved to: {args.summary_csv}")
+    if args.bouts_csv:
+        write_bouts(results, args.bouts_csv)
+        print(f"Contact bouts saved to: {args.bouts_csv}")
+
+if __name__ == "__main__":
+    main()
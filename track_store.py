@@ -0,0 +1,146 @@
+import os
+import csv
+import struct
+import argparse
+import numpy as np
+
+# File layout: a 64-byte header followed by a C-ordered float32 array of
+# shape (num_frames, num_classes, 2) holding X/Y per frame and class,
+# with NaN where a class has no position in a frame.
+MAGIC = b'MTRK'
+VERSION = 1
+HEADER_FORMAT = '<4sIqqq'
+HEADER_SIZE = 64
+DTYPE = np.dtype('<f4')
+STORE_EXTENSION = '.tracks'
+
+def store_path_for(csv_path):
+    """Return the track store path that sits next to a CSV file."""
+    return os.path.splitext(csv_path)[0] + STORE_EXTENSION
+
+def read_header(path):
+    """Read a track store header and return (first_frame, num_frames, num_classes)."""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f"{path} is too short to be a track store")
+
+    magic, version, first_frame, num_frames, num_classes = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a track store")
+    if version != VERSION:
+        raise ValueError(f"Unsupported track store version {version} in {path}")
+    return first_frame, num_frames, num_classes
+
+def create_track_store(path, first_frame, num_frames, num_classes):
+    """
+    Create a new track store filled with NaN and return a writable
+    memory-mapped array of shape (num_frames, num_classes, 2).
+    """
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, first_frame, num_frames, num_classes)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    positions = map_positions(path, 'r+', num_frames, num_classes)
+    positions[:] = np.nan
+    return positions
+
+def map_positions(path, mode, num_frames, num_classes):
+    """Memory-map the position array of a track store (numpy cannot map an empty region)."""
+    shape = (num_frames, num_classes, 2)
+    if num_frames * num_classes == 0:
+        return np.empty(shape, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode=mode, offset=HEADER_SIZE, shape=shape)
+
+def write_track_store(path, first_frame, positions):
+    """Write a (frames, classes, 2) position array to a new track store."""
+    store = create_track_store(path, first_frame, positions.shape[0], positions.shape[1])
+    store[:] = positions
+    if isinstance(store, np.memmap):
+        store.flush()
+
+class TrackStore:
+    """
+    Memory-mapped view of a track store file.
+
+    Opening a store only reads its header; positions are paged in from disk as
+    they are accessed, so frame-range slices involve no parsing.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.first_frame, self.num_frames, self.num_classes = read_header(path)
+        self.positions = map_positions(path, mode, self.num_frames, self.num_classes)
+
+    @property
+    def frames(self):
+        """Frame numbers covered by the store."""
+        return np.arange(self.first_frame, self.first_frame + self.num_frames)
+
+    def frame_range(self, start_frame=None, end_frame=None):
+        """Positions for frames start_frame..end_frame (inclusive) as a memory-mapped slice."""
+        start = 0 if start_frame is None else max(start_frame - self.first_frame, 0)
+        stop = self.num_frames if end_frame is None else max(end_frame - self.first_frame + 1, 0)
+        return self.positions[start:stop]
+
+    def class_track(self, class_id):
+        """Return (frames, positions) for one class, skipping frames where it is missing."""
+        track = self.positions[:, class_id]
+        present = ~np.isnan(track[:, 0])
+        return self.frames[present], np.asarray(track[present])
+
+def open_track_store(path, mode='r'):
+    """Memory-map an existing track store. Use mode='r+' to edit it in place."""
+    return TrackStore(path, mode)
+
+def csv_to_track_store(csv_path, store_path=None):
+    """Convert a processed tracking CSV into a track store and return its path."""
+    store_path = store_path or store_path_for(csv_path)
+    with open(csv_path, 'r') as infile:
+        reader = csv.DictReader(infile)
+        rows = [(row['Frame'], row['Class'], row['X'], row['Y']) for row in reader]
+
+    if not rows:
+        create_track_store(store_path, 0, 0, 0)
+        return store_path
+
+    columns = np.array(rows, dtype=float)
+    frames = columns[:, 0].astype(int)
+    classes = columns[:, 1].astype(int)
+    first_frame = int(frames.min())
+
+    positions = np.full((frames.max() - first_frame + 1, classes.max() + 1, 2), np.nan, dtype=DTYPE)
+    positions[frames - first_frame, classes] = columns[:, 2:4]
+    write_track_store(store_path, first_frame, positions)
+    return store_path
+
+def track_store_to_csv(store_path, csv_path):
+    """Write a track store back out as a processed tracking CSV."""
+    store = open_track_store(store_path)
+    frame_idx, class_ids = np.nonzero(~np.isnan(store.positions[..., 0]))
+    points = store.positions[frame_idx, class_ids]
+
+    with open(csv_path, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['Frame', 'ID', 'Class', 'X', 'Y'])
+        for frame, class_id, (x, y) in zip(frame_idx + store.first_frame, class_ids, points):
+            writer.writerow([frame, f'Class_{class_id}', class_id, float(x), float(y)])
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between processed tracking CSV files and track stores.")
+    parser.add_argument("input", help="Path to a processed CSV file or a .tracks store")
+    parser.add_argument("output", nargs='?',
+                        help="Output path (default: the input path with the other extension)")
+
+    args = parser.parse_args()
+
+    if args.input.endswith(STORE_EXTENSION):
+        output = args.output or os.path.splitext(args.input)[0] + '.csv'
+        track_store_to_csv(args.input, output)
+    else:
+        output = csv_to_track_store(args.input, args.output)
+
+    print(f"Saved to: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,10 @@ bl_info = {
 import bpy
 import csv
 import os
-from bpy.props import StringProperty, FloatProperty, EnumProperty
+import time
+import struct
+from bpy.props import StringProperty, FloatProperty, EnumProperty, IntProperty, BoolProperty
 from bpy.types import Panel, Operator, PropertyGroup
-from collections import defaultdict
 import numpy as np
 
 class TrackerProperties(PropertyGroup):
@@ -43,6 +44,41 @@ class TrackerProperties(PropertyGroup):
         default=50.0,
         min=0.0
     )
+    num_mice: IntProperty(
+        name="Number of Mice",
+        description="Number of mice in the recording",
+        default=5,
+        min=1
+    )
+    class_layout: EnumProperty(
+        name="Class Layout",
+        description="How body and head classes are numbered",
+        items=[
+            ('interleaved', "Interleaved", "Body and head alternate: (0, 1), (2, 3), ..."),
+            ('blocked', "Blocked", "All bodies first, then all heads: (0, N), (1, N+1), ..."),
+        ],
+        default='interleaved'
+    )
+    proxy_size: EnumProperty(
+        name="Proxy Size",
+        description="Resolution of the proxy used for playback",
+        items=[
+            ('25', "25%", "Build and play back a quarter-resolution proxy"),
+            ('50', "50%", "Build and play back a half-resolution proxy"),
+            ('75', "75%", "Build and play back a three-quarter-resolution proxy"),
+        ],
+        default='25'
+    )
+    build_proxy_on_import: BoolProperty(
+        name="Build Proxy on Import",
+        description="Build a proxy and timecode index in the background after importing",
+        default=True
+    )
+    proxy_status: StringProperty(
+        name="Proxy Status",
+        description="State of the background proxy build",
+        default=""
+    )
     def get_tracker_classes(self, context):
         clip = context.space_data.clip
         if clip:
@@ -57,120 +93,337 @@ class TrackerProperties(PropertyGroup):
 
 class CSVProcessor:
     @staticmethod
-    def process_csv(input_csv, processed_csv, threshold):
+    def build_class_layout(num_mice=5, layout='interleaved'):
+        # Returns a list of (body_class, head_class) pairs, one per mouse
+        if layout == 'interleaved':
+            return [(mouse_index * 2, mouse_index * 2 + 1) for mouse_index in range(num_mice)]
+        if layout == 'blocked':
+            return [(mouse_index, mouse_index + num_mice) for mouse_index in range(num_mice)]
+        raise ValueError(f"Unknown class layout: {layout}")
+
+    @staticmethod
+    def paired_class(class_id, num_mice=5, layout='interleaved'):
+        # Returns the head class for a body class and vice versa
+        for body_class, head_class in CSVProcessor.build_class_layout(num_mice, layout):
+            if class_id == body_class:
+                return head_class
+            if class_id == head_class:
+                return body_class
+        return None
+
+    @staticmethod
+    def read_detections(input_csv):
         with open(input_csv, 'r') as infile:
             reader = csv.DictReader(infile)
-            data = list(reader)
-
-        # Group data by Frame, then by Class
-        grouped_data = defaultdict(lambda: defaultdict(list))
-        for row in data:
-            frame = int(row['Frame'])
-            class_id = int(row['Class'])
-            grouped_data[frame][class_id].append((float(row['X']), float(row['Y'])))
-
-        # Process data frame by frame
-        processed_data = []
-        for frame, frame_data in sorted(grouped_data.items()):
-            for mouse_index in range(5):  # Assuming 5 mice
-                body_class = mouse_index * 2
-                head_class = mouse_index * 2 + 1
-
-                body_points = frame_data.get(body_class, [])
-                head_points = frame_data.get(head_class, [])
-
-                # Handle body points
-                if body_points:
-                    if len(body_points) > 1:
-                        # If multiple body points, choose the one closest to the head
-                        if head_points:
-                            head_point = head_points[0]  # Use the first head point as reference
-                            body_point = min(body_points, key=lambda p: ((p[0]-head_point[0])**2 + (p[1]-head_point[1])**2)**0.5)
-                        else:
-                            body_point = body_points[0]  # If no head point, use the first body point
-                    else:
-                        body_point = body_points[0]
-
-                    processed_data.append({
-                        'Frame': frame,
-                        'ID': f'Class_{body_class}',
-                        'Class': body_class,
-                        'X': body_point[0],
-                        'Y': body_point[1]
-                    })
-
-                # Handle head points
-                if head_points:
-                    if len(head_points) > 1:
-                        # If multiple head points, choose the one closest to the body
-                        if body_points:
-                            body_point = body_points[0]  # Use the first body point as reference
-                            head_point = min(head_points, key=lambda p: ((p[0]-body_point[0])**2 + (p[1]-body_point[1])**2)**0.5)
-                        else:
-                            head_point = head_points[0]  # If no body point, use the first head point
-                    else:
-                        head_point = head_points[0]
+            rows = [(row['Frame'], row['Class'], row['X'], row['Y']) for row in reader]
 
-                    processed_data.append({
-                        'Frame': frame,
-                        'ID': f'Class_{head_class}',
-                        'Class': head_class,
-                        'X': head_point[0],
-                        'Y': head_point[1]
-                    })
+        if not rows:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, 2))
 
-        # Sort processed data by Frame, then by Class
-        processed_data.sort(key=lambda x: (x['Frame'], x['Class']))
+        columns = np.array(rows, dtype=float)
+        frames, classes, points = columns[:, 0].astype(int), columns[:, 1].astype(int), columns[:, 2:4]
 
-        # Interpolate missing frames and apply threshold
-        interpolated_data = CSVProcessor.interpolate_and_threshold(processed_data, threshold)
+        # Sort by Class, then Frame, keeping the original order within a frame, so
+        # each class's rows form one contiguous, frame-sorted block
+        order = np.argsort(frames, kind='stable')
+        order = order[np.argsort(classes[order], kind='stable')]
+        return frames[order], classes[order], points[order]
+
+    @staticmethod
+    def class_rows(sorted_classes, class_id):
+        return slice(np.searchsorted(sorted_classes, class_id, side='left'),
+                     np.searchsorted(sorted_classes, class_id, side='right'))
+
+    @staticmethod
+    def first_per_frame(frames):
+        mask = np.ones(len(frames), dtype=bool)
+        mask[1:] = frames[1:] != frames[:-1]
+        return mask
 
-        # Write processed and interpolated data to CSV
-        with open(processed_csv, 'w', newline='') as outfile:
-            fieldnames = ['Frame', 'ID', 'Class', 'X', 'Y']
-            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(interpolated_data)
+    @staticmethod
+    def assign_body_head(body_frames, body_xy, head_frames, head_xy):
+        # Pick at most one body and one head point per frame. Where both classes have
+        # candidates, the closest body-head pair wins; otherwise the first candidate is kept.
+        head_start = np.searchsorted(head_frames, body_frames, side='left')
+        head_count = np.searchsorted(head_frames, body_frames, side='right') - head_start
+        pair_body = np.repeat(np.arange(len(body_frames)), head_count)
+        pair_offset = np.arange(head_count.sum()) - np.repeat(np.cumsum(head_count) - head_count, head_count)
+        pair_head = np.repeat(head_start, head_count) + pair_offset
+
+        delta = body_xy[pair_body] - head_xy[pair_head]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        pair_frames = body_frames[pair_body]
+        order = np.lexsort((distance, pair_frames))
+        best = order[CSVProcessor.first_per_frame(pair_frames[order])]
+
+        body_alone = CSVProcessor.first_per_frame(body_frames) & (head_count == 0)
+        head_alone = CSVProcessor.first_per_frame(head_frames) & ~np.isin(head_frames, body_frames)
+
+        body_idx = np.sort(np.concatenate([pair_body[best], np.flatnonzero(body_alone)]))
+        head_idx = np.sort(np.concatenate([pair_head[best], np.flatnonzero(head_alone)]))
+        return body_idx, head_idx
 
     @staticmethod
-    def interpolate_and_threshold(data, threshold):
-        # Group data by Class
-        grouped_data = defaultdict(list)
-        for row in data:
-            grouped_data[row['Class']].append(row)
+    def process_csv(input_csv, processed_csv, threshold, num_mice=5, layout='interleaved'):
+        frames, classes, points = CSVProcessor.read_detections(input_csv)
 
-        interpolated_data = []
+        # Dense array of frames x classes x (X, Y), NaN where a class is missing
+        class_layout = CSVProcessor.build_class_layout(num_mice, layout)
+        first_frame = int(frames.min()) if len(frames) else 0
+        num_frames = int(frames.max()) - first_frame + 1 if len(frames) else 0
+        num_classes = max(max(pair) for pair in class_layout) + 1
+        positions = np.full((num_frames, num_classes, 2), np.nan)
 
-        for class_id, class_data in grouped_data.items():
-            frames = np.array([row['Frame'] for row in class_data])
-            x_values = np.array([row['X'] for row in class_data])
-            y_values = np.array([row['Y'] for row in class_data])
+        # Resolve duplicates mouse by mouse
+        for body_class, head_class in class_layout:
+            body_rows = CSVProcessor.class_rows(classes, body_class)
+            head_rows = CSVProcessor.class_rows(classes, head_class)
+            body_frames, body_points = frames[body_rows], points[body_rows]
+            head_frames, head_points = frames[head_rows], points[head_rows]
 
-            # Create a full range of frames
-            full_frames = np.arange(frames.min(), frames.max() + 1)
+            body_idx, head_idx = CSVProcessor.assign_body_head(body_frames, body_points, head_frames, head_points)
+
+            positions[body_frames[body_idx] - first_frame, body_class] = body_points[body_idx]
+            positions[head_frames[head_idx] - first_frame, head_class] = head_points[head_idx]
+
+        # Interpolate missing frames and apply threshold
+        positions = CSVProcessor.interpolate_and_threshold(positions, threshold)
 
-            # Interpolate X and Y values
-            x_interp = np.interp(full_frames, frames, x_values)
-            y_interp = np.interp(full_frames, frames, y_values)
+        # Write processed and interpolated data to CSV and to the track store
+        TrackStore.write_csv(processed_csv, first_frame, positions)
+        TrackStore.write(TrackStore.store_path_for(processed_csv), first_frame, positions)
+
+    @staticmethod
+    def interpolate_and_threshold(positions, threshold):
+        interpolated = np.full_like(positions, np.nan)
+        all_frames = np.arange(len(positions))
+
+        for class_id in range(positions.shape[1]):
+            present = np.flatnonzero(~np.isnan(positions[:, class_id, 0]))
+            if not len(present):
+                continue
+
+            # Create a full range of frames and interpolate X and Y values
+            full_frames = all_frames[present[0]:present[-1] + 1]
+            x_interp = np.interp(full_frames, present, positions[present, class_id, 0])
+            y_interp = np.interp(full_frames, present, positions[present, class_id, 1])
 
             # Apply threshold to interpolated values
-            prev_x, prev_y = x_interp[0], y_interp[0]
-            for i, (frame, x, y) in enumerate(zip(full_frames, x_interp, y_interp)):
-                if i > 0:
-                    if abs(x - prev_x) > threshold or abs(y - prev_y) > threshold:
-                        x, y = prev_x, prev_y
-                interpolated_data.append({
-                    'Frame': int(frame),
-                    'ID': f'Class_{class_id}',
-                    'Class': class_id,
-                    'X': x,
-                    'Y': y
-                })
-                prev_x, prev_y = x, y
-
-        # Sort interpolated data by Frame, then by Class
-        interpolated_data.sort(key=lambda x: (x['Frame'], x['Class']))
-        return interpolated_data
+            x_values, y_values = x_interp.tolist(), y_interp.tolist()
+            prev_x, prev_y = x_values[0], y_values[0]
+            for i in range(1, len(x_values)):
+                if abs(x_values[i] - prev_x) > threshold or abs(y_values[i] - prev_y) > threshold:
+                    x_values[i], y_values[i] = prev_x, prev_y
+                prev_x, prev_y = x_values[i], y_values[i]
+
+            interpolated[full_frames, class_id, 0] = x_values
+            interpolated[full_frames, class_id, 1] = y_values
+
+        return interpolated
+
+class TrackStore:
+    # Same binary layout as track_store.py: a 64-byte header followed by a
+    # float32 array of shape (frames, classes, 2), NaN where a class is missing.
+    MAGIC = b'MTRK'
+    VERSION = 1
+    HEADER_FORMAT = '<4sIqqq'
+    HEADER_SIZE = 64
+    DTYPE = np.dtype('<f4')
+
+    @staticmethod
+    def store_path_for(csv_path):
+        return os.path.splitext(csv_path)[0] + '.tracks'
+
+    @staticmethod
+    def write(path, first_frame, positions):
+        header = struct.pack(TrackStore.HEADER_FORMAT, TrackStore.MAGIC, TrackStore.VERSION,
+                             first_frame, positions.shape[0], positions.shape[1])
+        with open(path, 'wb') as f:
+            f.write(header.ljust(TrackStore.HEADER_SIZE, b'\0'))
+            f.write(np.ascontiguousarray(positions, dtype=TrackStore.DTYPE).tobytes())
+
+    @staticmethod
+    def read(path):
+        # Returns (first_frame, positions) with positions memory-mapped from disk
+        with open(path, 'rb') as f:
+            header = f.read(TrackStore.HEADER_SIZE)
+        magic, version, first_frame, num_frames, num_classes = struct.unpack_from(TrackStore.HEADER_FORMAT, header)
+        if magic != TrackStore.MAGIC or version != TrackStore.VERSION:
+            raise ValueError(f"{path} is not a supported track store")
+
+        shape = (num_frames, num_classes, 2)
+        if num_frames * num_classes == 0:
+            return first_frame, np.empty(shape, dtype=TrackStore.DTYPE)
+        return first_frame, np.memmap(path, dtype=TrackStore.DTYPE, mode='r', offset=TrackStore.HEADER_SIZE, shape=shape)
+
+    @staticmethod
+    def read_csv(csv_path):
+        # Returns (first_frame, positions) parsed from a processed CSV
+        with open(csv_path, 'r') as file:
+            reader = csv.DictReader(file)
+            rows = [(row['Frame'], row['Class'], row['X'], row['Y']) for row in reader]
+
+        if not rows:
+            return 0, np.empty((0, 0, 2))
+
+        columns = np.array(rows, dtype=float)
+        frames = columns[:, 0].astype(int)
+        classes = columns[:, 1].astype(int)
+        first_frame = int(frames.min())
+
+        positions = np.full((frames.max() - first_frame + 1, classes.max() + 1, 2), np.nan)
+        positions[frames - first_frame, classes] = columns[:, 2:4]
+        return first_frame, positions
+
+    @staticmethod
+    def write_csv(csv_path, first_frame, positions):
+        # Rows sorted by Frame, then by Class
+        frame_idx, class_ids = np.nonzero(~np.isnan(positions[..., 0]))
+        points = positions[frame_idx, class_ids]
+
+        with open(csv_path, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['Frame', 'ID', 'Class', 'X', 'Y'])
+            for frame, class_id, (x, y) in zip((frame_idx + first_frame).tolist(), class_ids.tolist(), points.tolist()):
+                writer.writerow([frame, f'Class_{class_id}', class_id, x, y])
+
+    @staticmethod
+    def load_positions(csv_path):
+        # Memory-map the track store next to the CSV when it is at least as new as the CSV,
+        # otherwise fall back to parsing the CSV
+        store_path = TrackStore.store_path_for(csv_path)
+        if os.path.exists(store_path) and os.path.getmtime(store_path) >= os.path.getmtime(csv_path):
+            return TrackStore.read(store_path)
+        return TrackStore.read_csv(csv_path)
+
+class ProxyBuilder:
+    # Blender builds proxies as a background job; a timer watches the proxy file
+    # and switches playback to the proxy once it is done. Marker coordinates are
+    # always converted with the clip's full-resolution size, never the proxy's.
+    BUILD_FLAGS = {'25': 'build_25', '50': 'build_50', '75': 'build_75'}
+    POLL_INTERVAL = 1.0
+    START_TIMEOUT = 10.0
+
+    @staticmethod
+    def full_resolution(clip):
+        # The size is recorded the first time the clip is seen, before any proxy is in use
+        if "mouse_tracker_resolution" not in clip:
+            clip["mouse_tracker_resolution"] = (clip.size[0], clip.size[1])
+        width, height = clip["mouse_tracker_resolution"]
+        return width, height
+
+    @staticmethod
+    def proxy_path(clip, size, part=False):
+        # Default location Blender writes movie clip proxies to. While the job runs
+        # the proxy is written to proxy_<size>_part.avi and renamed when it finishes.
+        clip_path = bpy.path.abspath(clip.filepath)
+        name = f"proxy_{size}_part.avi" if part else f"proxy_{size}.avi"
+        return os.path.join(os.path.dirname(clip_path), "BL_proxy", os.path.basename(clip_path), name)
+
+    @staticmethod
+    def clip_area(context, clip):
+        # Prefer the editor the operator was run from
+        if context.area and context.area.type == 'CLIP_EDITOR' and context.area.spaces.active.clip == clip:
+            return context.area
+        for area in context.screen.areas:
+            if area.type == 'CLIP_EDITOR' and area.spaces.active.clip == clip:
+                return area
+        return None
+
+    @staticmethod
+    def configure(clip, size):
+        ProxyBuilder.full_resolution(clip)
+        clip.use_proxy = True
+        clip.use_proxy_custom_directory = False
+        for proxy_size, flag in ProxyBuilder.BUILD_FLAGS.items():
+            setattr(clip.proxy, flag, proxy_size == size)
+        clip.proxy.build_100 = False
+        clip.proxy.build_free_run = True
+
+    @staticmethod
+    def apply(clip, size):
+        # Play back the proxy with its free-run timecode index in every editor showing the clip
+        clip.use_proxy = True
+        clip.proxy.timecode = 'FREE_RUN'
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'CLIP_EDITOR' and area.spaces.active.clip == clip:
+                    area.spaces.active.clip_user.proxy_render_size = f'PROXY_{size}'
+                    area.tag_redraw()
+
+    @staticmethod
+    def start(context, clip, size):
+        # rebuild_proxy acts on the clip of the editor in context, so run it in
+        # an editor that shows this clip
+        area = ProxyBuilder.clip_area(context, clip)
+        if area is None:
+            return False
+
+        ProxyBuilder.configure(clip, size)
+        override = {
+            'window': context.window,
+            'screen': context.screen,
+            'area': area,
+            'region': next(region for region in area.regions if region.type == 'WINDOW'),
+            'space_data': area.spaces.active,
+        }
+        if hasattr(context, "temp_override"):
+            with context.temp_override(**override):
+                bpy.ops.clip.rebuild_proxy()
+        else:
+            bpy.ops.clip.rebuild_proxy(override)
+
+        props = context.scene.tracker_props
+        props.proxy_status = f"Building {size}% proxy..."
+        started_at = time.time()
+        clip_name = clip.name
+        scene_name = context.scene.name
+        last_file_size = [-1]
+
+        def poll():
+            scene = bpy.data.scenes.get(scene_name)
+            clip = bpy.data.movieclips.get(clip_name)
+            if scene is None or clip is None:
+                return None
+            props = scene.tracker_props
+            elapsed = int(time.time() - started_at)
+
+            try:
+                # Done once the part file has been renamed and the proxy no longer changes
+                proxy_file = ProxyBuilder.proxy_path(clip, size)
+                building = os.path.exists(ProxyBuilder.proxy_path(clip, size, part=True))
+                file_size = os.path.getsize(proxy_file) if os.path.exists(proxy_file) else -1
+                running = building or file_size < 0 or file_size != last_file_size[0]
+                last_file_size[0] = file_size
+
+                if running and not building and file_size < 0 and elapsed > ProxyBuilder.START_TIMEOUT:
+                    # Neither file appeared: the job was cancelled or could not start
+                    props.proxy_status = f"Proxy build failed: no {size}% proxy was written"
+                    ProxyBuilder.redraw_panels()
+                    return None
+
+                if running:
+                    props.proxy_status = f"Building {size}% proxy... {elapsed // 60}:{elapsed % 60:02d}"
+                    ProxyBuilder.redraw_panels()
+                    return ProxyBuilder.POLL_INTERVAL
+
+                ProxyBuilder.apply(clip, size)
+                props.proxy_status = f"Playing {size}% proxy (built in {elapsed // 60}:{elapsed % 60:02d})"
+            except Exception as e:
+                # Never leave the panel stuck on "Building..."
+                props.proxy_status = f"Proxy build failed: {e}"
+            ProxyBuilder.redraw_panels()
+            return None
+
+        bpy.app.timers.register(poll, first_interval=ProxyBuilder.POLL_INTERVAL)
+        return True
+
+    @staticmethod
+    def redraw_panels():
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'CLIP_EDITOR':
+                    area.tag_redraw()
 
 class TRACKER_OT_import(Operator):
     bl_idname = "tracker.import"
@@ -180,16 +433,19 @@ class TRACKER_OT_import(Operator):
         props = context.scene.tracker_props
         
         # Process the CSV file
-        CSVProcessor.process_csv(props.input_csv, props.processed_csv, props.threshold)
+        CSVProcessor.process_csv(props.input_csv, props.processed_csv, props.threshold, props.num_mice, props.class_layout)
         
         # Load the video into the Movie Clip Editor
         clip = bpy.data.movieclips.load(filepath=props.input_mp4)
         
-        # Set the loaded clip as active in the Movie Clip Editor
-        for area in bpy.context.screen.areas:
-            if area.type == 'CLIP_EDITOR':
-                area.spaces.active.clip = clip
-                break
+        # Set the loaded clip as active in the Movie Clip Editor, preferring the one the operator was run from
+        if context.space_data and context.space_data.type == 'CLIP_EDITOR':
+            context.space_data.clip = clip
+        else:
+            for area in bpy.context.screen.areas:
+                if area.type == 'CLIP_EDITOR':
+                    area.spaces.active.clip = clip
+                    break
 
         # Set scene frame start and end to match the clip
         context.scene.frame_start = clip.frame_start
@@ -201,26 +457,28 @@ class TRACKER_OT_import(Operator):
         # Force Blender to update the view
         bpy.ops.clip.view_all()
 
+        # Build a low-resolution proxy for smooth scrubbing in the background
+        if props.build_proxy_on_import and not ProxyBuilder.start(context, clip, props.proxy_size):
+            self.report({'WARNING'}, "Open the clip in a Movie Clip Editor to build its proxy")
+
         self.report({'INFO'}, f"Trackers imported and processed from {props.input_csv}")
         return {'FINISHED'}
 
     def load_tracking_data(self, clip, csv_path):
-        with open(csv_path, 'r') as file:
-            reader = csv.DictReader(file)
-            tracks = defaultdict(list)
-            
-            for row in reader:
-                tracks[int(row['Class'])].append({
-                    'frame': int(row['Frame']),
-                    'x': float(row['X']),
-                    'y': float(row['Y'])
-                })
-
-        for class_id, markers in tracks.items():
+        first_frame, positions = TrackStore.load_positions(csv_path)
+        width, height = ProxyBuilder.full_resolution(clip)
+
+        for class_id in range(positions.shape[1]):
+            present = np.flatnonzero(~np.isnan(positions[:, class_id, 0]))
+            if not len(present):
+                continue
+
             track = clip.tracking.tracks.new(name=f"Class_{class_id}")
-            for marker in markers:
-                blender_marker = track.markers.insert_frame(marker['frame'])
-                blender_marker.co = (marker['x'] / clip.size[0], 1 - (marker['y'] / clip.size[1]))
+            co_x = positions[present, class_id, 0] / width
+            co_y = 1 - positions[present, class_id, 1] / height
+            for frame, x, y in zip((present + first_frame).tolist(), co_x.tolist(), co_y.tolist()):
+                blender_marker = track.markers.insert_frame(frame)
+                blender_marker.co = (x, y)
 
 class TRACKER_OT_export(Operator):
     bl_idname = "tracker.export"
@@ -249,6 +507,7 @@ class TRACKER_OT_export(Operator):
 
             frame_start = clip.frame_start
             frame_end = frame_start + clip.frame_duration - 1
+            width, height = ProxyBuilder.full_resolution(clip)
 
             print(f"Exporting frames from {frame_start} to {frame_end}")
 
@@ -265,8 +524,8 @@ class TRACKER_OT_export(Operator):
                     
                     if marker and marker.mute == False:
                         # Convert normalized coordinates back to pixel coordinates
-                        x = marker.co[0] * clip.size[0]
-                        y = (1 - marker.co[1]) * clip.size[1]
+                        x = marker.co[0] * width
+                        y = (1 - marker.co[1]) * height
                         
                         writer.writerow([frame, track.name, class_id, x, y])
                         print(f"Wrote data for frame {frame}, track {track.name}")
@@ -275,6 +534,10 @@ class TRACKER_OT_export(Operator):
 
             print("Export completed")
 
+        # Keep the track store next to the CSV in sync with the exported data
+        first_frame, positions = TrackStore.read_csv(csv_path)
+        TrackStore.write(TrackStore.store_path_for(csv_path), first_frame, positions)
+
         # Check if any data was written
         with open(csv_path, 'r') as f:
             lines = f.readlines()
@@ -315,7 +578,8 @@ class TRACKER_OT_reprocess(Operator):
         fps = clip.fps
 
         # Reprocess from current frame to end
-        self.reprocess_track(props.input_csv, props.processed_csv, class_id, current_frame, clip.frame_duration, fps, props.threshold)
+        self.reprocess_track(props.input_csv, props.processed_csv, class_id, current_frame, clip.frame_duration, fps, props.threshold,
+                             props.num_mice, props.class_layout)
 
         # Reload the clip with updated tracking data
         self.reload_clip_with_new_data(clip, props.input_mp4, props.processed_csv)
@@ -323,93 +587,77 @@ class TRACKER_OT_reprocess(Operator):
         self.report({'INFO'}, f"Reprocessed track {class_name} from frame {current_frame}")
         return {'FINISHED'}
 
-    def reprocess_track(self, input_csv, processed_csv, selected_class_id, start_frame, total_frames, fps, threshold):
+    def reprocess_track(self, input_csv, processed_csv, selected_class_id, start_frame, total_frames, fps, threshold,
+                        num_mice=5, layout='interleaved'):
         # Determine the paired class ID (body if head, head if body)
-        paired_class_id = selected_class_id - 1 if selected_class_id % 2 else selected_class_id + 1
+        paired_class_id = CSVProcessor.paired_class(selected_class_id, num_mice, layout)
 
-        # Read all CSV data
-        with open(input_csv, 'r') as file:
-            reader = csv.DictReader(file)
-            all_data = list(reader)
-
-        # Group data by Frame, then by Class
-        grouped_data = defaultdict(lambda: defaultdict(list))
-        for row in all_data:
-            frame = int(row['Frame'])
-            class_id = int(row['Class'])
-            if frame >= start_frame and class_id in (selected_class_id, paired_class_id):
-                grouped_data[frame][class_id].append((float(row['X']), float(row['Y'])))
-
-        # Process data frame by frame
-        processed_data = []
-        for frame, frame_data in sorted(grouped_data.items()):
-            selected_points = frame_data.get(selected_class_id, [])
-            paired_points = frame_data.get(paired_class_id, [])
-
-            if selected_points:
-                if len(selected_points) > 1 and paired_points:
-                    # If multiple points, choose the one closest to the paired point
-                    paired_point = paired_points[0]  # Use the first paired point as reference
-                    selected_point = min(selected_points, key=lambda p: ((p[0]-paired_point[0])**2 + (p[1]-paired_point[1])**2)**0.5)
-                else:
-                    selected_point = selected_points[0]
-
-                processed_data.append({
-                    'Frame': frame,
-                    'ID': f'Class_{selected_class_id}',
-                    'Class': selected_class_id,
-                    'X': selected_point[0],
-                    'Y': selected_point[1]
-                })
-
-        # Sort the processed data
-        processed_data.sort(key=lambda x: x['Frame'])
+        # Read all CSV data, keeping the selected and paired classes from the start frame on
+        frames, classes, points = CSVProcessor.read_detections(input_csv)
+        in_range = frames >= start_frame
+        selected_mask = in_range & (classes == selected_class_id)
+        paired_mask = in_range & (classes == paired_class_id)
+        selected_frames, selected_points = frames[selected_mask], points[selected_mask]
+        paired_frames, paired_points = frames[paired_mask], points[paired_mask]
 
-        # Apply threshold
-        threshold_removed_until_frame = start_frame + fps
-        prev_x, prev_y = None, None
+        # Choose the selected point that forms the closest pair with the paired class
+        selected_idx, _ = CSVProcessor.assign_body_head(selected_frames, selected_points, paired_frames, paired_points)
 
-        for row in processed_data:
-            frame = int(row['Frame'])
-            x, y = float(row['X']), float(row['Y'])
+        selected_frames, selected_points = selected_frames[selected_idx], selected_points[selected_idx]
 
-            if prev_x is not None and prev_y is not None:
-                if frame >= threshold_removed_until_frame:
-                    if abs(x - prev_x) > threshold or abs(y - prev_y) > threshold:
-                        x, y = prev_x, prev_y
-
-            row['X'], row['Y'] = str(x), str(y)
-            prev_x, prev_y = x, y
-
-        # Read existing processed CSV data
-        with open(processed_csv, 'r') as file:
-            reader = csv.DictReader(file)
-            existing_data = [row for row in reader if int(row['Class']) != selected_class_id or int(row['Frame']) < start_frame]
-
-        # Merge and write the data back to the processed CSV
-        all_data = existing_data + processed_data
-        all_data.sort(key=lambda x: (int(x['Frame']), int(x['Class'])))
-
-        with open(processed_csv, 'w', newline='') as file:
-            fieldnames = ['Frame', 'ID', 'Class', 'X', 'Y']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(all_data)
+        # Apply threshold
+        threshold_removed_until_frame = start_frame + fps
+        x_values, y_values = selected_points[:, 0].tolist(), selected_points[:, 1].tolist()
+
+        for i, frame in enumerate(selected_frames.tolist()):
+            if i > 0 and frame >= threshold_removed_until_frame:
+                if abs(x_values[i] - x_values[i - 1]) > threshold or abs(y_values[i] - y_values[i - 1]) > threshold:
+                    x_values[i], y_values[i] = x_values[i - 1], y_values[i - 1]
+
+        # Load the existing processed data, grown to cover the reprocessed frames and class
+        first_frame, existing = TrackStore.load_positions(processed_csv)
+        if not existing.size:
+            first_frame = start_frame
+        last_frame = max(first_frame + len(existing) - 1, int(selected_frames.max()) if len(selected_frames) else -1)
+        new_first_frame = min(first_frame, start_frame)
+        num_classes = max(existing.shape[1], selected_class_id + 1)
+
+        positions = np.full((last_frame - new_first_frame + 1, num_classes, 2), np.nan)
+        offset = first_frame - new_first_frame
+        positions[offset:offset + len(existing), :existing.shape[1]] = existing
+        del existing  # release the memory map before the store is rewritten
+
+        # Replace the selected class from the start frame on
+        positions[start_frame - new_first_frame:, selected_class_id] = np.nan
+        positions[selected_frames - new_first_frame, selected_class_id, 0] = x_values
+        positions[selected_frames - new_first_frame, selected_class_id, 1] = y_values
+
+        # Write the data back to the processed CSV and the track store
+        TrackStore.write_csv(processed_csv, new_first_frame, positions)
+        TrackStore.write(TrackStore.store_path_for(processed_csv), new_first_frame, positions)
 
     def reload_clip_with_new_data(self, clip, video_path, csv_path):
         # Clear existing tracks
         bpy.ops.clip.select_all(action='SELECT')
         bpy.ops.clip.delete_track()
 
-        # Reload the video clip
+        # Reload the video clip, keeping its full-resolution size and proxy settings
+        resolution = ProxyBuilder.full_resolution(clip)
+        used_proxy = clip.use_proxy
         bpy.data.movieclips.remove(clip)
         new_clip = bpy.data.movieclips.load(filepath=video_path)
+        new_clip["mouse_tracker_resolution"] = resolution
         
         for area in bpy.context.screen.areas:
             if area.type == 'CLIP_EDITOR':
                 area.spaces.active.clip = new_clip
                 break
 
+        if used_proxy:
+            proxy_size = bpy.context.scene.tracker_props.proxy_size
+            ProxyBuilder.configure(new_clip, proxy_size)
+            ProxyBuilder.apply(new_clip, proxy_size)
+
         # Load new tracking data
         self.load_tracking_data(new_clip, csv_path)
 
@@ -418,22 +666,43 @@ class TRACKER_OT_reprocess(Operator):
 
     @staticmethod
     def load_tracking_data(clip, csv_path):
-        with open(csv_path, 'r') as file:
-            reader = csv.DictReader(file)
-            tracks = defaultdict(list)
-            
-            for row in reader:
-                tracks[int(row['Class'])].append({
-                    'frame': int(row['Frame']),
-                    'x': float(row['X']),
-                    'y': float(row['Y'])
-                })
-
-        for class_id, markers in tracks.items():
+        first_frame, positions = TrackStore.load_positions(csv_path)
+        width, height = ProxyBuilder.full_resolution(clip)
+
+        for class_id in range(positions.shape[1]):
+            present = np.flatnonzero(~np.isnan(positions[:, class_id, 0]))
+            if not len(present):
+                continue
+
             track = clip.tracking.tracks.new(name=f"Class_{class_id}")
-            for marker in markers:
-                blender_marker = track.markers.insert_frame(marker['frame'])
-                blender_marker.co = (marker['x'] / clip.size[0], 1 - (marker['y'] / clip.size[1]))
+            co_x = positions[present, class_id, 0] / width
+            co_y = 1 - positions[present, class_id, 1] / height
+            for frame, x, y in zip((present + first_frame).tolist(), co_x.tolist(), co_y.tolist()):
+                blender_marker = track.markers.insert_frame(frame)
+                blender_marker.co = (x, y)
+
+class TRACKER_OT_build_proxy(Operator):
+    bl_idname = "tracker.build_proxy"
+    bl_label = "Build Playback Proxy"
+    bl_description = "Build a downscaled proxy and timecode index in the background and switch playback to it"
+
+    def execute(self, context):
+        props = context.scene.tracker_props
+        clip = context.space_data.clip
+
+        if not clip:
+            self.report({'ERROR'}, "No clip loaded in the Movie Clip Editor")
+            return {'CANCELLED'}
+
+        if not ProxyBuilder.start(context, clip, props.proxy_size):
+            self.report({'ERROR'}, f"{clip.name} is not shown in a Movie Clip Editor")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Building {props.proxy_size}% proxy for {clip.name}")
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.space_data.type == 'CLIP_EDITOR' and context.space_data.clip
 
 class TRACKER_PT_main_panel(Panel):
     bl_label = "Mouse Tracker Import/Export"
@@ -452,6 +721,8 @@ class TRACKER_PT_main_panel(Panel):
         box.prop(props, "input_csv")
         box.prop(props, "input_mp4")
         box.prop(props, "threshold")
+        box.prop(props, "num_mice")
+        box.prop(props, "class_layout")
         box.operator("tracker.import")
 
         # Export section
@@ -466,11 +737,27 @@ class TRACKER_PT_main_panel(Panel):
         box.prop(props, "selected_tracker_class")
         box.operator("tracker.reprocess")
 
+        # Playback proxy section
+        box = layout.box()
+        box.label(text="Playback Proxy")
+        box.prop(props, "proxy_size")
+        box.prop(props, "build_proxy_on_import")
+        box.operator("tracker.build_proxy")
+        if props.proxy_status:
+            if props.proxy_status.startswith("Building"):
+                icon = 'TIME'
+            elif props.proxy_status.startswith("Proxy build failed"):
+                icon = 'ERROR'
+            else:
+                icon = 'CHECKMARK'
+            box.label(text=props.proxy_status, icon=icon)
+
 classes = (
     TrackerProperties,
     TRACKER_OT_import,
     TRACKER_OT_export,
     TRACKER_OT_reprocess,
+    TRACKER_OT_build_proxy,
     TRACKER_PT_main_panel
 )
 
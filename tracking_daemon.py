@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import queue
+import shutil
+import fnmatch
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ultralytics import YOLOv10
+from process_video_folder import process_video
+
+DEFAULT_PRIORITY = 10
+DEFAULT_KEEP_FINISHED = 100
+
+class Job:
+    """A video waiting for or going through tracking."""
+
+    def __init__(self, video_path, priority, sequence):
+        self.video_path = video_path
+        self.name = os.path.basename(video_path)
+        self.priority = priority
+        self.sequence = sequence
+        self.state = 'queued'
+        self.frames_done = 0
+        self.total_frames = 0
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.outputs = []
+
+    def __lt__(self, other):
+        # Lower priority numbers run first; equal priorities run in arrival order
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def update_progress(self, frames_done, total_frames):
+        self.frames_done = frames_done
+        self.total_frames = total_frames
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            'name': self.name,
+            'priority': self.priority,
+            'state': self.state,
+            'frames_done': self.frames_done,
+            'total_frames': self.total_frames,
+            'progress': self.frames_done / self.total_frames if self.total_frames else 0.0,
+            'fps': self.frames_done / elapsed if elapsed > 0 else 0.0,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'outputs': self.outputs,
+        }
+
+def unique_path(folder, name):
+    """Path for `name` in `folder`, with a numeric suffix if that file already exists."""
+    stem, ext = os.path.splitext(name)
+    path = os.path.join(folder, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{stem}_{counter}{ext}")
+        counter += 1
+    return path
+
+class TrackingDaemon:
+    """
+    Watches an inbox folder and tracks new videos with models kept in memory.
+
+    Each worker thread owns one loaded model (tracker state is kept on the
+    model, so models cannot be shared between concurrent videos). New videos
+    are queued once their size stops changing between two scans. Only the
+    last `keep_finished` finished jobs are kept; older ones are folded into
+    the totals.
+    """
+
+    def __init__(self, model_path, inbox, output_folder, archive_folder, max_concurrent=1,
+                 priorities=None, poll_interval=5.0, status_file=None, keep_finished=DEFAULT_KEEP_FINISHED):
+        self.inbox = inbox
+        self.output_folder = output_folder
+        self.archive_folder = archive_folder
+        self.failed_folder = os.path.join(archive_folder, 'failed')
+        self.priorities = priorities or []
+        self.poll_interval = poll_interval
+        self.status_file = status_file
+        self.keep_finished = keep_finished
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        os.makedirs(self.failed_folder, exist_ok=True)
+
+        # Load the models once, up front
+        print(f"Loading {max_concurrent} model(s) from {model_path}")
+        self.models = [YOLOv10(model_path) for _ in range(max_concurrent)]
+
+        self.queue = queue.PriorityQueue()
+        self.jobs = []
+        self.active_paths = set()
+        self.stuck_paths = set()
+        self.pending_sizes = {}
+        self.dropped_counts = {'done': 0, 'failed': 0}
+        self.dropped_frames = 0
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.started_at = time.time()
+        self.stopping = threading.Event()
+
+    def priority_for(self, filename):
+        """Return the priority of the first matching pattern, or the default."""
+        for pattern, priority in self.priorities:
+            if fnmatch.fnmatch(filename, pattern):
+                return priority
+        return DEFAULT_PRIORITY
+
+    def scan_inbox(self):
+        """Queue videos in the inbox whose size has not changed since the last scan."""
+        present = set()
+        for entry in os.scandir(self.inbox):
+            if not entry.name.endswith('.mp4') or entry.name.endswith('_output.mp4'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+            except OSError:
+                # Archived or removed since the folder was listed
+                continue
+            present.add(entry.path)
+            with self.lock:
+                if entry.path in self.active_paths or entry.path in self.stuck_paths:
+                    continue
+
+            # Wait until the file is no longer being copied in
+            if size == 0 or self.pending_sizes.get(entry.path) != size:
+                self.pending_sizes[entry.path] = size
+                continue
+            del self.pending_sizes[entry.path]
+
+            with self.lock:
+                job = Job(entry.path, self.priority_for(entry.name), self.sequence)
+                self.sequence += 1
+                self.jobs.append(job)
+                self.active_paths.add(entry.path)
+            self.queue.put(job)
+            print(f"Queued {job.name} (priority {job.priority})")
+
+        # Forget files that left the inbox before they were queued or moved
+        for path in set(self.pending_sizes) - present:
+            del self.pending_sizes[path]
+        with self.lock:
+            self.stuck_paths &= present
+
+    def worker(self, model):
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            job.state = 'running'
+            job.started_at = time.time()
+            print(f"Processing {job.name}")
+            try:
+                job.outputs = list(process_video(model, job.video_path, self.output_folder, job.update_progress))
+                shutil.move(job.video_path, unique_path(self.archive_folder, job.name))
+                job.state = 'done'
+                print(f"Finished {job.name}")
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+                print(f"Error processing {job.name}: {e}")
+                try:
+                    if os.path.exists(job.video_path):
+                        shutil.move(job.video_path, unique_path(self.failed_folder, job.name))
+                except Exception as move_error:
+                    job.error += f"; could not move it to {self.failed_folder}: {move_error}"
+                    print(f"Error moving {job.name} to {self.failed_folder}: {move_error}")
+            finally:
+                job.finished_at = time.time()
+                with self.lock:
+                    self.active_paths.discard(job.video_path)
+                    # A video that could not be moved out of the inbox is not retried
+                    if job.state == 'failed' and os.path.exists(job.video_path):
+                        self.stuck_paths.add(job.video_path)
+                    self.prune_jobs()
+                self.queue.task_done()
+
+    def prune_jobs(self):
+        """Drop the oldest finished jobs beyond `keep_finished`, keeping their totals. Call with the lock held."""
+        finished = sorted((job for job in self.jobs if job.finished_at is not None), key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.keep_finished, 0)]:
+            self.jobs.remove(job)
+            self.dropped_counts[job.state] += 1
+            self.dropped_frames += job.frames_done
+
+    def status(self):
+        """Snapshot of the kept jobs plus totals and overall throughput for all jobs."""
+        with self.lock:
+            jobs = [job.to_dict() for job in self.jobs]
+            dropped_counts = dict(self.dropped_counts)
+            dropped_frames = self.dropped_frames
+
+        uptime = time.time() - self.started_at
+        frames_done = dropped_frames + sum(job['frames_done'] for job in jobs)
+        counts = {state: dropped_counts.get(state, 0) + sum(job['state'] == state for job in jobs)
+                  for state in ('queued', 'running', 'done', 'failed')}
+        return {
+            'inbox': self.inbox,
+            'uptime': uptime,
+            'workers': len(self.models),
+            'jobs_by_state': counts,
+            'frames_done': frames_done,
+            'fps': frames_done / uptime if uptime > 0 else 0.0,
+            'jobs': jobs,
+        }
+
+    def write_status(self):
+        """Write the status as JSON, replacing the file atomically."""
+        if not self.status_file:
+            return
+        temp_path = f"{self.status_file}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(temp_path, self.status_file)
+
+    def serve_status(self, port):
+        """Serve the status as JSON on http://127.0.0.1:<port>/status in a background thread."""
+        daemon = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/status'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(daemon.status(), indent=2).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), StatusHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Status available at http://127.0.0.1:{port}/status")
+        return server
+
+    def run(self, status_port=None):
+        """Scan the inbox until interrupted with Ctrl+C."""
+        workers = [threading.Thread(target=self.worker, args=(model,), daemon=True) for model in self.models]
+        for thread in workers:
+            thread.start()
+        server = self.serve_status(status_port) if status_port else None
+
+        print(f"Watching {self.inbox} for new videos")
+        try:
+            while True:
+                try:
+                    self.scan_inbox()
+                    self.write_status()
+                except Exception as e:
+                    # A failed scan is retried on the next poll instead of stopping the daemon
+                    print(f"Error scanning {self.inbox}: {e}")
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping after the running jobs finish...")
+        finally:
+            self.stopping.set()
+            for thread in workers:
+                thread.join()
+            if server:
+                server.shutdown()
+            self.write_status()
+
+def parse_priority(value):
+    """Parse a PATTERN=LEVEL command-line priority rule."""
+    pattern, _, level = value.rpartition('=')
+    if not pattern:
+        raise argparse.ArgumentTypeError(f"Expected PATTERN=LEVEL, got '{value}'")
+    try:
+        return pattern, int(level)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Priority level must be an integer, got '{level}'")
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and track new videos with a YOLOv10 model kept in memory.")
+    parser.add_argument("model_path", help="Path to the YOLOv10 model file")
+    parser.add_argument("inbox", help="Folder to watch for new .mp4 videos")
+    parser.add_argument("-o", "--output-folder",
+                        help="Folder for the _output.mp4 and _output.csv files (default: <inbox>/output)")
+    parser.add_argument("-a", "--archive-folder",
+                        help="Folder where processed videos are moved (default: <inbox>/processed)")
+    parser.add_argument("-c", "--max-concurrent", type=int, default=1,
+                        help="Number of videos tracked at the same time, one model each (default: 1)")
+    parser.add_argument("-p", "--priority", type=parse_priority, action="append", default=[],
+                        help="PATTERN=LEVEL rule; videos matching the filename pattern get that priority, "
+                             f"lower runs first (default level: {DEFAULT_PRIORITY}). Can be repeated")
+    parser.add_argument("--poll-interval", type=float, default=5.0,
+                        help="Seconds between inbox scans (default: 5.0)")
+    parser.add_argument("--status-file", help="Path of a JSON file updated with job progress and throughput")
+    parser.add_argument("--status-port", type=int, help="Serve job status as JSON on this local port")
+    parser.add_argument("--keep-finished", type=int, default=DEFAULT_KEEP_FINISHED,
+                        help=f"Number of finished jobs listed in the status (default: {DEFAULT_KEEP_FINISHED})")
+
+    args = parser.parse_args()
+
+    daemon = TrackingDaemon(
+        args.model_path,
+        args.inbox,
+        args.output_folder or os.path.join(args.inbox, 'output'),
+        args.archive_folder or os.path.join(args.inbox, 'processed'),
+        args.max_concurrent,
+        args.priority,
+        args.poll_interval,
+        args.status_file,
+        args.keep_finished,
+    )
+    daemon.run(args.status_port)
+
+if __name__ == "__main__":
+    main()